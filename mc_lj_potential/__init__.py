@@ -5,6 +5,8 @@ A python package to carry out Monte Carlo simulation of Lennard Jones particles.
 
 # Add imports here
 from .mc_lj_potential import *
+from .parallel import *
+from .trajectory import *
 
 # Handle versioneer
 from ._version import get_versions
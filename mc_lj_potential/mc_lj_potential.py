@@ -6,63 +6,520 @@ Handles the primary functions
 """
 
 
+import atexit
+import concurrent.futures
+import itertools
+import json
+import os
+import signal
+import tempfile
+import threading
+import warnings
+import weakref
+from multiprocessing import shared_memory
+
 import numpy as np
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
+NUMBA_AVAILABLE = numba is not None
+
+__all__ = ['NUMBA_AVAILABLE', 'BACKENDS', 'LennardJonesTable', 'share_array', 'attach_shared_array',
+           'release_shared_array', 'Box', 'MCState', 'spawn_generators', 'parse_box_length', 'read_xyz_frames',
+           'read_xyz', 'generate_initial_state', 'accept_or_reject', 'adjust_displacement', 'print_progress',
+           'SimulationTerminated', 'Simulation', 'resume', 'ReplicaSimulation']
+
+def _lennard_jones_kernel(rij2):
+    sig_by_r6 = (1.0 / rij2)**3
+    return 4.0 * (sig_by_r6 * sig_by_r6 - sig_by_r6)
+
+def _minimum_image_kernel(r_i, r_j, box_lengths):
+    rij2 = 0.0
+    for k in range(r_i.shape[0]):
+        rij = r_i[k] - r_j[k]
+        rij -= box_lengths[k] * np.rint(rij / box_lengths[k])
+        rij2 += rij * rij
+    return rij2
+
+def _pair_potential_kernel(rij2, coefficients, r2_min, inverse_spacing):
+    if coefficients.shape[0] == 0 or rij2 < r2_min:
+        return _lennard_jones_kernel(rij2)
+    x = (rij2 - r2_min) * inverse_spacing
+    k = min(int(x), coefficients.shape[0] - 1)
+    t = x - k
+    return coefficients[k, 0] + t * (coefficients[k, 1] + t * (coefficients[k, 2] + t * coefficients[k, 3]))
+
+def _particle_energy_kernel(coordinates, i_particle, position, box_lengths, cutoff2, coefficients, r2_min,
+                            inverse_spacing):
+    e_total = 0.0
+    for j_particle in range(coordinates.shape[0]):
+        if j_particle != i_particle:
+            rij2 = _minimum_image_kernel(position, coordinates[j_particle], box_lengths)
+            if rij2 < cutoff2:
+                e_total += _pair_potential_kernel(rij2, coefficients, r2_min, inverse_spacing)
+    return e_total
+
+def _total_pair_energy_kernel(coordinates, box_lengths, cutoff2, first_row, last_row, coefficients, r2_min,
+                              inverse_spacing):
+    e_total = 0.0
+    for i_particle in range(first_row, last_row):
+        for j_particle in range(i_particle):
+            rij2 = _minimum_image_kernel(coordinates[i_particle], coordinates[j_particle], box_lengths)
+            if rij2 < cutoff2:
+                e_total += _pair_potential_kernel(rij2, coefficients, r2_min, inverse_spacing)
+    return e_total
+
+if NUMBA_AVAILABLE:
+    _lennard_jones_kernel = numba.njit(nogil=True)(_lennard_jones_kernel)
+    _pair_potential_kernel = numba.njit(nogil=True)(_pair_potential_kernel)
+    _minimum_image_kernel = numba.njit(nogil=True)(_minimum_image_kernel)
+    _particle_energy_kernel = numba.njit(nogil=True)(_particle_energy_kernel)
+    _total_pair_energy_kernel = numba.njit(nogil=True)(_total_pair_energy_kernel)
+
+BACKENDS = ('python', 'numpy', 'numba', 'cell', 'verlet')
+
+_NO_TABLE = np.zeros((0, 4))
+
+class LennardJonesTable:
+    """
+    Lennard Jones potential tabulated on an evenly spaced grid of squared distances.
+
+    The potential is interpolated between grid points either linearly or with cubic Hermite polynomials built from the
+    analytic derivative. Squared distances below r_min**2, where the potential is too steep to tabulate, are evaluated
+    analytically. The largest interpolation error, found by comparing 15 points inside every grid interval with the
+    analytic potential, is stored in max_error.
+
+    Parameters
+    ----------
+    cutoff : float
+        Largest distance covered by the table.
+    r_min : float. Default is 0.8.
+        Smallest distance covered by the table.
+    n_points : integer. Default is 4096.
+        Number of grid points between r_min**2 and cutoff**2.
+    method : string. Either 'linear' or 'cubic'.
+        Interpolation between grid points. Default is 'cubic'.
+    """
+    def __init__(self, cutoff, r_min=0.8, n_points=4096, method='cubic'):
+        if method not in ('linear', 'cubic'):
+            raise ValueError("method must be either 'linear' or 'cubic', got %r" % (method,))
+        if n_points < 2 or not 0.0 < r_min < cutoff:
+            raise ValueError("The table needs n_points >= 2 and 0 < r_min < cutoff")
+        self.cutoff = cutoff
+        self.r_min = r_min
+        self.n_points = n_points
+        self.method = method
+        self.r2_min = r_min**2
+        grid = np.linspace(self.r2_min, cutoff**2, n_points)
+        spacing = grid[1] - grid[0]
+        self.inverse_spacing = 1.0 / spacing
+        u0 = self.potential(grid[:-1])
+        u1 = self.potential(grid[1:])
+        self.coefficients = np.zeros((n_points - 1, 4))
+        self.coefficients[:, 0] = u0
+        if method == 'linear':
+            self.coefficients[:, 1] = u1 - u0
+        else:
+            m0 = spacing * self.derivative(grid[:-1])
+            m1 = spacing * self.derivative(grid[1:])
+            self.coefficients[:, 1] = m0
+            self.coefficients[:, 2] = 3.0 * (u1 - u0) - 2.0 * m0 - m1
+            self.coefficients[:, 3] = 2.0 * (u0 - u1) + m0 + m1
+        t = np.linspace(0.0, 1.0, 17)[1:-1, np.newaxis]
+        rij2 = grid[np.newaxis, :-1] + t * spacing
+        self.max_error = float(np.max(np.abs(self(rij2) - self.potential(rij2))))
+
+    @staticmethod
+    def potential(rij2):
+        """
+        Computes the analytic Lennard Jones potential.
+
+        Parameters
+        ----------
+        rij2 : np.array
+            Squares of minimum image distances between atom pairs.
+
+        Returns
+        -------
+        Lennard Jones potential : np.array
+            Lennard Jones potential between the atom pairs.
+        """
+        sig_by_r6 = (1.0 / rij2)**3
+        return 4.0 * (sig_by_r6 * sig_by_r6 - sig_by_r6)
+
+    @staticmethod
+    def derivative(rij2):
+        """
+        Computes the derivative of the Lennard Jones potential with respect to the squared distance.
+
+        Parameters
+        ----------
+        rij2 : np.array
+            Squares of minimum image distances between atom pairs.
+
+        Returns
+        -------
+        derivative : np.array
+            Derivative of the Lennard Jones potential at rij2.
+        """
+        sig_by_r6 = (1.0 / rij2)**3
+        return 12.0 * sig_by_r6 * (1.0 - 2.0 * sig_by_r6) / rij2
+
+    def __call__(self, rij2):
+        """
+        Interpolates the Lennard Jones potential.
+
+        Parameters
+        ----------
+        rij2 : float or np.array
+            Squares of minimum image distances between atom pairs, below cutoff**2.
+
+        Returns
+        -------
+        Lennard Jones potential : float or np.array
+            Lennard Jones potential between the atom pairs.
+        """
+        scalar = np.ndim(rij2) == 0
+        rij2 = np.atleast_1d(np.asarray(rij2, dtype=float))
+        x = (rij2 - self.r2_min) * self.inverse_spacing
+        k = np.clip(x, 0, len(self.coefficients) - 1).astype(np.intp)
+        t = x - k
+        c = self.coefficients[k]
+        energy = c[..., 0] + t * (c[..., 1] + t * (c[..., 2] + t * c[..., 3]))
+        below = rij2 < self.r2_min
+        if np.any(below):
+            energy[below] = self.potential(rij2[below])
+        return float(energy[0]) if scalar else energy
+
+_owned_blocks = {}
+_attached_blocks = {}
+_block_views = {}
+_released_blocks = []
+
+def _shared_view(block, shape, dtype):
+    view = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    _block_views.setdefault(block.name, []).append(weakref.ref(view))
+    return view
+
+def _close_released_blocks():
+    for block, views in list(_released_blocks):
+        if all(view() is None for view in views):
+            block.close()
+            _released_blocks.remove((block, views))
+
+def share_array(array):
+    """
+    Copies an array into a new shared memory block owned by the current process.
+
+    The blocks are released by release_shared_array(), or at the latest when the interpreter exits. If the process
+    is killed, the multiprocessing resource tracker unlinks the blocks it leaked.
+
+    Parameters
+    ----------
+    array : np.array
+        Array to share.
+
+    Returns
+    -------
+    shared : np.array
+        View of the shared memory block holding a copy of array.
+    handle : tuple
+        Name, shape and dtype of the block, from which other processes attach with attach_shared_array().
+    """
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    _owned_blocks[block.name] = block
+    shared = _shared_view(block, array.shape, array.dtype)
+    shared[...] = array
+    return shared, (block.name, array.shape, array.dtype.str)
+
+def attach_shared_array(handle):
+    """
+    Attaches to a shared memory block created by share_array(), without copying it.
+
+    Parameters
+    ----------
+    handle : tuple
+        Handle returned by share_array().
+
+    Returns
+    -------
+    shared : np.array
+        View of the shared memory block.
+    """
+    name, shape, dtype = handle
+    if name in _owned_blocks:
+        block = _owned_blocks[name]
+    elif name in _attached_blocks:
+        block = _attached_blocks[name]
+    else:
+        block = shared_memory.SharedMemory(name=name)
+        _attached_blocks[name] = block
+    return _shared_view(block, shape, dtype)
+
+def release_shared_array(handle):
+    """
+    Detaches from a shared memory block, and destroys it if the current process created it.
+
+    The segment is unlinked at once, but its mapping is only closed when no array viewing it is left alive, since
+    closing it earlier would leave those arrays pointing to unmapped memory.
+
+    Parameters
+    ----------
+    handle : tuple
+        Handle returned by share_array().
+    """
+    name = handle[0]
+    owned = name in _owned_blocks
+    block = _owned_blocks.pop(name) if owned else _attached_blocks.pop(name, None)
+    if block is None:
+        return
+    if owned:
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            pass
+    _released_blocks.append((block, _block_views.pop(name, [])))
+    _close_released_blocks()
+
+@atexit.register
+def _release_all_shared_arrays():
+    for name in list(_owned_blocks) + list(_attached_blocks):
+        release_shared_array((name,))
+
 class Box:
-    def __init__(self, box_length, coordinates=None):
+    """
+    Periodic simulation box holding the particle coordinates and, optionally, a cell list.
+
+    The box is cubic, orthorhombic or triclinic. Its cell matrix has the three edge vectors of the box as rows, so that
+    a position is fractional coordinates times the cell matrix. Orthorhombic boxes, cubic ones included, apply the
+    minimum image convention along each axis; triclinic boxes apply it in fractional coordinates.
+
+    Parameters
+    ----------
+    box_length : float, np.array(3) or np.array(3,3)
+        Side of cubic simulation box, three edge lengths of an orthorhombic box, or cell matrix of a triclinic box.
+    coordinates : np.array(num_particles,3). Default is None.
+        A numpy array with the x, y and z coordinates of each atom in the simulation box. It is stored as a
+        C-contiguous array of dtype.
+    cell_width : float. Default is None.
+        If given, a cell list with cells at least cell_width wide is built.
+    dtype : np.dtype. Default is np.float64.
+        Storage dtype of the coordinates. np.float32 halves their memory; energies are still accumulated in float64.
+    """
+    __slots__ = ('_box_length', 'inverse_box_length', '_volume', 'cell', 'inverse_cell', 'lengths', 'widths',
+                 'orthorhombic', 'dtype', '_coordinates', '_num_particles', 'cell_width', 'cells_per_side',
+                 'particle_cell', 'cell_members', 'cell_neighbors', 'shared_handle', 'geometry_version')
+
+    def __init__(self, box_length, coordinates=None, cell_width=None, dtype=np.float64):
+        self.geometry_version=0
+        self.cell_width=None
+        self.cells_per_side=None
+        self.particle_cell=None
+        self.cell_members=None
+        self.cell_neighbors=None
+        self.shared_handle=None
         self.box_length=box_length
+        self.dtype=np.dtype(dtype)
         self.coordinates=coordinates
-    def wrap(self, coordinates,box_length):
+        if (cell_width is not None and coordinates is not None):
+            self.build_cell_list(cell_width)
+
+    def wrap(self, coordinates=None, box_length=None, indices=None):
         """
-        This is for wrapping all particles in the box, updating the coordinates.
+        Wraps positions back into the box, between -1/2 and 1/2 in fractional coordinates along each edge.
+
+        Floating point arrays are wrapped in place; other inputs, such as lists or integer arrays, are wrapped into a
+        new array.
 
         Parameters
         ----------
+        coordinates : np.array(num_particles,3) or np.array(3). Default is None.
+            Positions to wrap. If None, the coordinates of the box are wrapped.
+        box_length : float, np.array(3) or np.array(3,3). Default is None.
+            Geometry of the box, as in the constructor. If None, the geometry of the box is used.
+        indices : integer, slice or np.array. Default is None.
+            Rows of coordinates to wrap. If None, all rows are wrapped.
+
+        Returns
+        -------
         coordinates : np.array
-            Original coordinates from the generate_initial_state function.
-        box_length : float
-            Side of cubic simulation box.
+            The wrapped positions.
+        """
+        if coordinates is None:
+            coordinates = self.coordinates
+        box = self.get_box(box_length)
+        in_place = (isinstance(coordinates, np.ndarray) and coordinates.dtype.kind == 'f'
+                    and coordinates.flags.writeable)
+        if not in_place:
+            coordinates = np.array(coordinates, dtype=float)
+        if indices is None:
+            box.minimum_image(coordinates, out=coordinates)
+        else:
+            coordinates[indices] = box.minimum_image(coordinates[indices])
+        return coordinates
 
+    def minimum_image(self, rij, out=None):
         """
-        if (coordinates is not None):
-            self.coordinates = self.coordinates - self.box_length*np.round(self.coordinates/self.box_length)
-    def minimum_image_distance(self, r_i, r_j, box_length):
+        Applies the minimum image convention to displacement vectors.
+
+        Parameters
+        ----------
+        rij : np.array(..., 3)
+            Displacements between atom pairs, for example an (M, 3) batch.
+        out : np.array. Default is None.
+            Array receiving the result, such as rij itself for an in-place update. If None, a new array is returned.
+
+        Returns
+        -------
+        rij : np.array(..., 3)
+            Minimum image displacements.
         """
-        Computes the minimum image distance between two particles.
+        if self.orthorhombic:
+            shift = np.round(rij * self.inverse_box_length)
+            shift *= self.box_length
+        else:
+            shift = np.round(rij @ self.inverse_cell) @ self.cell
+        return np.subtract(rij, shift, out=out)
+
+    def minimum_image_distance(self, r_i, r_j, box_length=None):
+        """
+        Computes the minimum image distance between two particles, or between batches of particles.
+
+        The positions broadcast against each other, so r_i and r_j can be two positions, two (M, 3) arrays of pairs, or
+        one position and an (M, 3) array to compute the distances of all of them to that position.
 
         Parameters
         ----------
-        r_i : float
+        r_i : np.array(3) or np.array(M,3)
             Position of particle i
-        r_j : float
+        r_j : np.array(3) or np.array(M,3)
             Position of particle j
-        box_length : float
-            Side of cubic simulation box.
+        box_length : float, np.array(3) or np.array(3,3). Default is None.
+            Geometry of the box, as in the constructor. If None, the geometry of the box is used.
 
         Returns
         -------
-        rij2 :  float
-            Square of minimum image distance between an atom pair.
+        rij2 :  float or np.array(M)
+            Square of minimum image distance between each atom pair.
         """
-        rij = r_i - r_j
-        rij = rij - self.box_length * np.round(rij / self.box_length)
-        rij2 = np.dot(rij, rij)
-        return rij2
-        
+        rij = np.subtract(r_i, r_j, dtype=float)
+        self.get_box(box_length).minimum_image(rij, out=rij)
+        if rij.ndim == 1:
+            return np.dot(rij, rij)
+        return np.einsum('...k,...k->...', rij, rij)
+
+    def get_box(self, box_length=None):
+        """
+        Returns the box itself, or an empty box of another geometry when box_length differs from the box length.
+
+        Parameters
+        ----------
+        box_length : float, np.array(3) or np.array(3,3). Default is None.
+            Geometry of the box, as in the constructor. If None, the box itself is returned.
+
+        Returns
+        -------
+        box : Box
+            Box with the requested geometry.
+        """
+        if box_length is None or box_length is self._box_length or np.array_equal(box_length, self._box_length):
+            return self
+        return Box(box_length)
+
+    @property
+    def box_length(self):
+        """ Property decorator function which returns the geometry of the simulation box.
+
+        It is the side of a cubic box, the three edge lengths of an orthorhombic box, or the cell matrix of a
+        triclinic box. Setting it recomputes the cell matrix and its inverse, the edge lengths, the widths between
+        opposite faces, the inverse box length and the volume, which are cached on the box, and rebuilds the cell
+        list, if any, for the new geometry.
+        """
+        return self._box_length
+
+    @box_length.setter
+    def box_length(self, box_length):
+        if np.ndim(box_length) == 0:
+            cell = np.eye(3) * float(box_length)
+            self.inverse_box_length = 1.0 / box_length
+            self._volume = box_length**3
+        else:
+            box_length = np.array(box_length, dtype=float)
+            if box_length.shape == (3,):
+                cell = np.diag(box_length)
+            elif box_length.shape == (3, 3):
+                cell = box_length
+            else:
+                raise ValueError("box_length must be a number, three edge lengths or a 3x3 cell matrix, got shape %s"
+                                 % (box_length.shape,))
+            if np.count_nonzero(cell - np.diag(np.diag(cell))) == 0:
+                box_length = np.diag(cell).copy()
+                self.inverse_box_length = 1.0 / box_length
+            else:
+                self.inverse_box_length = None
+            self._volume = abs(float(np.linalg.det(cell)))
+        if self._volume == 0:
+            raise ValueError("The box has no volume")
+        self._box_length = box_length
+        self.orthorhombic = self.inverse_box_length is not None
+        self.cell = cell
+        self.inverse_cell = np.linalg.inv(cell)
+        self.lengths = np.linalg.norm(cell, axis=1)
+        self.widths = 1.0 / np.linalg.norm(self.inverse_cell, axis=0)
+        self.geometry_changed()
+
+    @property
+    def coordinates(self):
+        """ Property decorator function which returns the coordinates of the particles in the box.
+
+        Setting the coordinates stores them as a C-contiguous array of the box dtype, copying them only when needed,
+        recounts the particles, whose number is cached on the box, and rebuilds the cell list, if any. When the
+        coordinates were moved to shared memory, the new ones are copied to a new shared block and the old block is
+        released.
+        """
+        return self._coordinates
+
+    @coordinates.setter
+    def coordinates(self, coordinates):
+        if coordinates is not None:
+            coordinates = np.ascontiguousarray(coordinates, dtype=self.dtype)
+        if self.shared_handle is not None:
+            old_handle = self.shared_handle
+            self.shared_handle = None
+            if coordinates is not None:
+                coordinates, self.shared_handle = share_array(coordinates)
+            release_shared_array(old_handle)
+        self._coordinates = coordinates
+        self._num_particles = None if coordinates is None else len(coordinates)
+        self.geometry_changed()
+
+    def geometry_changed(self):
+        """
+        Rebuilds the cell list, if any, after the box length or the coordinates were replaced, and bumps
+        geometry_version so that the states built on the box rebuild their own indices before their next use.
+        """
+        self.geometry_version += 1
+        if self.cell_members is not None and self.coordinates is not None:
+            self.build_cell_list(self.cell_width)
+
     @property
     def volume(self):
-        """ Property decorator function which calculates the volume of the cubic simulation box.
+        """ Property decorator function which calculates the volume of the simulation box.
         
         Parameters
         ----------
-        box_length : float
-            Side of cubic simulation box.
+        box_length : float, np.array(3) or np.array(3,3)
+            Geometry of the simulation box.
         
         Returns
         -------
-        volume=box_length**3 : float
+        volume=box_length**3 for a cubic box, or the absolute determinant of the cell matrix : float
         """
-        return self.box_length**3
+        return self._volume
     
     @property
     def num_particles(self):
@@ -70,28 +527,591 @@ class Box:
         
         Parameters
         ----------
-        coordinates : np.array(num_particles,3)
-            A numpy array with the x, y and z coordinates of each atom in the simulation box.
-       
-       Returns
+        coordinates : np.array(num_particles,3)
+            A numpy array with the x, y and z coordinates of each atom in the simulation box.
+       
+       Returns
+        -------
+        num_particles=number of particles in the simulation box : integer
+        """
+        return self._num_particles
+
+    def build_cell_list(self, cell_width, cells_per_side=None):
+        """
+        Builds the cell-list spatial index of the particles in the box.
+
+        The fractional coordinates of the box are split into a grid of cells whose opposite faces are at least
+        cell_width apart, so that all partners of a particle within cell_width lie in its own cell or in one of the
+        26 surrounding cells.
+
+        Parameters
+        ----------
+        cell_width : float
+            Minimum width of a cell, usually the cutoff of the potential.
+        cells_per_side : integer or sequence of three integers. Default is None.
+            Number of cells along each edge of the box, overriding cell_width. Used to rebuild an existing grid.
+        """
+        if cells_per_side is None:
+            cells_per_side = np.maximum(1, (self.widths // cell_width).astype(int))
+        self.cells_per_side = tuple(int(n_side) for n_side in np.broadcast_to(cells_per_side, (3,)))
+        self.cell_width = float(np.min(self.widths / self.cells_per_side)) if cell_width is None else cell_width
+        n_cells = int(np.prod(self.cells_per_side))
+        self.particle_cell = self.get_cell_index(self.coordinates)
+        self.cell_members = [[] for i_cell in range(n_cells)]
+        for i_particle, i_cell in enumerate(self.particle_cell):
+            self.cell_members[i_cell].append(i_particle)
+
+        offsets = np.array([[dx, dy, dz] for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)])
+        cell_grid = np.array(np.unravel_index(np.arange(n_cells), self.cells_per_side)).T
+        self.cell_neighbors = []
+        for grid_position in cell_grid:
+            neighbor_grid = (grid_position + offsets) % self.cells_per_side
+            neighbor_cells = np.ravel_multi_index(neighbor_grid.T, self.cells_per_side)
+            self.cell_neighbors.append(np.unique(neighbor_cells))
+
+    def get_cell_index(self, positions):
+        """
+        Computes the flat index of the cell containing each position, taking periodic images into account.
+
+        Parameters
+        ----------
+        positions : np.array(num_positions,3) or np.array(3)
+            Positions to locate in the cell grid.
+
+        Returns
+        -------
+        cell_index : np.array(num_positions) or integer
+            Flat index of the cell containing each position.
+        """
+        if self.orthorhombic:
+            scaled = np.asarray(positions, dtype=float) * self.inverse_box_length
+        else:
+            scaled = np.asarray(positions, dtype=float) @ self.inverse_cell
+        scaled = scaled - np.floor(scaled)
+        cells_per_side = np.array(self.cells_per_side)
+        grid = (scaled * cells_per_side).astype(int) % cells_per_side
+        return np.ravel_multi_index(np.moveaxis(grid, -1, 0), self.cells_per_side)
+
+    def update_cell_list(self, i_particle):
+        """
+        Moves a particle to its new cell after its coordinates changed. Does nothing when no cell list is built.
+
+        Parameters
+        ----------
+        i_particle : integer
+            Particle whose coordinates changed.
+        """
+        if (self.cell_members is None):
+            return
+        new_cell = int(self.get_cell_index(self.coordinates[i_particle]))
+        old_cell = self.particle_cell[i_particle]
+        if new_cell != old_cell:
+            self.cell_members[old_cell].remove(i_particle)
+            self.cell_members[new_cell].append(i_particle)
+            self.particle_cell[i_particle] = new_cell
+
+    def get_neighbor_particles(self, position):
+        """
+        Collects the particles located in the cell of a position and in its surrounding cells.
+
+        Parameters
+        ----------
+        position : np.array(3)
+            Position whose neighborhood is searched.
+
+        Returns
+        -------
+        neighbors : np.array
+            Indices of the particles in the 27 cells around position.
+        """
+        i_cell = int(self.get_cell_index(position))
+        neighbors = [j_particle for j_cell in self.cell_neighbors[i_cell] for j_particle in self.cell_members[j_cell]]
+        return np.array(neighbors, dtype=int)
+
+    def move_particle(self, i_particle, position):
+        """
+        Places a particle at a new position and keeps the cell list, if any, up to date.
+
+        Parameters
+        ----------
+        i_particle : integer
+            Particle to move.
+        position : np.array(3)
+            New position of the particle.
+        """
+        self.coordinates[i_particle] = position
+        self.update_cell_list(i_particle)
+
+    def share_memory(self):
+        """
+        Moves the coordinates into a shared memory block, so that worker processes can attach to them without
+        copying. The coordinates stay usable as before in the current process.
+
+        Returns
+        -------
+        handle : dict
+            Box length and handle of the coordinates, from which other processes build a Box with from_shared_memory().
+        """
+        if self.shared_handle is None:
+            self._coordinates, self.shared_handle = share_array(self.coordinates)
+        return {'box_length': self.box_length, 'coordinates': self.shared_handle}
+
+    @classmethod
+    def from_shared_memory(cls, handle):
+        """
+        Builds a Box whose coordinates are a zero-copy view of a block shared by another process.
+
+        Parameters
+        ----------
+        handle : dict
+            Handle returned by share_memory().
+
+        Returns
+        -------
+        box : Box
+            Box attached to the shared coordinates.
+        """
+        return cls(handle['box_length'], attach_shared_array(handle['coordinates']), dtype=handle['coordinates'][2])
+
+    def release_shared_memory(self):
+        """
+        Copies the coordinates back into private memory and releases their shared memory block.
+        """
+        if self.shared_handle is None:
+            return
+        self._coordinates = np.array(self.coordinates)
+        release_shared_array(self.shared_handle)
+        self.shared_handle = None
+
+    #self.box_length=np.cbrt(self.num_particles / reduced_density)
+            
+class MCState:
+    __slots__ = ('box1', '_cutoff', 'cutoff2', 'tail_prefactor', 'lj_table', 'table_arguments', 'backend',
+                 'block_size', 'n_threads', 'skin', 'neighbor_start', 'neighbor_indices', 'reference_coordinates',
+                 'n_rebuilds', 'shared_handles', 'particle_energies', 'cache_check_frequency', 'n_cached_moves',
+                 'cache_drift', 'trial_particle', 'trial_position', 'trial_delta_e', 'trial_pair_energies',
+                 'total_pair_energy', 'particle_energy', 'tail_correction', 'unit_energy', 'geometry_version')
+
+    def __init__(self,box1,cutoff,backend='auto',block_size=2**20,skin=0.3,energy_cache=False,
+                 cache_check_frequency=None,n_threads=1,lj_table=None):
+        self.box1=box1
+        self.backend=None
+        self.lj_table=None
+        self.cutoff=cutoff
+        self.set_lj_table(lj_table)
+        self.block_size=block_size
+        self.n_threads=n_threads
+        self.skin=skin
+        self.neighbor_start=None
+        self.neighbor_indices=None
+        self.reference_coordinates=None
+        self.n_rebuilds=0
+        self.shared_handles=[]
+        self.particle_energies=None
+        self.cache_check_frequency=cache_check_frequency
+        self.n_cached_moves=0
+        self.cache_drift=0.0
+        self.trial_particle=None
+        self.trial_position=None
+        self.trial_delta_e=0.0
+        self.trial_pair_energies=None
+        self.total_pair_energy=0.0
+        self.particle_energy=0.0
+        self.tail_correction=0.0
+        self.unit_energy=0.0
+        self.set_backend(backend)
+        self.geometry_version=box1.geometry_version
+        if energy_cache:
+            self.build_energy_cache()
+
+    def share_memory(self):
+        """
+        Moves the box coordinates and, when built, the Verlet neighbor arrays into shared memory blocks.
+
+        Returns
+        -------
+        handle : dict
+            Handles from which other processes build an MCState with from_shared_memory().
+        """
+        handle = {'box': self.box1.share_memory(), 'cutoff': self.cutoff, 'block_size': self.block_size,
+                  'lj_table': self.lj_table}
+        if self.neighbor_indices is not None:
+            self.release_shared_memory(box=False)
+            self.neighbor_start, handle['neighbor_start'] = share_array(self.neighbor_start)
+            self.neighbor_indices, handle['neighbor_indices'] = share_array(self.neighbor_indices)
+            self.shared_handles = [handle['neighbor_start'], handle['neighbor_indices']]
+        return handle
+
+    def release_shared_memory(self, box=True):
+        """
+        Copies the shared arrays of the state back into private memory and releases their shared memory blocks.
+
+        Parameters
+        ----------
+        box : boolean
+            If true, the coordinates of the box are released as well.
+        """
+        if self.shared_handles:
+            self.neighbor_start = np.array(self.neighbor_start)
+            self.neighbor_indices = np.array(self.neighbor_indices)
+            for shared_handle in self.shared_handles:
+                release_shared_array(shared_handle)
+            self.shared_handles = []
+        if box:
+            self.box1.release_shared_memory()
+
+    @classmethod
+    def from_shared_memory(cls, handle, backend='numpy'):
+        """
+        Builds an MCState on a box and neighbor arrays shared by another process, without copying them.
+
+        Parameters
+        ----------
+        handle : dict
+            Handle returned by share_memory().
+        backend : string
+            Energy backend of the new state. The 'verlet' backend is not available, but the shared neighbor arrays
+            are attached as neighbor_start and neighbor_indices.
+
+        Returns
+        -------
+        mcs : MCState
+            State attached to the shared arrays.
+        """
+        mcs = cls(Box.from_shared_memory(handle['box']), handle['cutoff'], backend=backend,
+                  block_size=handle['block_size'], lj_table=handle.get('lj_table'))
+        if 'neighbor_indices' in handle:
+            mcs.neighbor_start = attach_shared_array(handle['neighbor_start'])
+            mcs.neighbor_indices = attach_shared_array(handle['neighbor_indices'])
+        return mcs
+
+    def rebuild_indices(self):
+        """
+        Rebuilds the cell list, the Verlet neighbor list and the per-particle energy cache, whichever are in use,
+        after the coordinates were changed without going through move_particle().
+        """
+        self.geometry_version = self.box1.geometry_version
+        if self.box1.cell_members is not None:
+            self.box1.build_cell_list(None, self.box1.cells_per_side)
+        if self.backend == 'verlet':
+            self.build_neighbor_list()
+        if self.particle_energies is not None:
+            self.build_energy_cache()
+
+    def check_indices(self):
+        """
+        Rebuilds the spatial indices and the energy cache of the state when the box length or the coordinates of
+        its box were replaced since they were last built.
+        """
+        if self.geometry_version != self.box1.geometry_version:
+            self.rebuild_indices()
+
+    @property
+    def cutoff(self):
+        """
+        Property decorator function which returns the cutoff of the Lennard Jones potential.
+
+        Setting the cutoff recomputes its square and the prefactor of the tail correction, which are cached on the
+        state, and rebuilds the cell list, the Verlet neighbor list and the energy cache for the new cutoff.
+        """
+        return self._cutoff
+
+    @cutoff.setter
+    def cutoff(self, cutoff):
+        if self.lj_table is not None and self.lj_table.cutoff < cutoff:
+            raise ValueError("The Lennard Jones table ends at %g, before the cutoff %g"
+                             % (self.lj_table.cutoff, cutoff))
+        self._cutoff = cutoff
+        self.cutoff2 = float(cutoff)**2
+        sig_by_cutoff3 = np.power(1.0 / cutoff, 3)
+        sig_by_cutoff9 = np.power(sig_by_cutoff3, 3)
+        self.tail_prefactor = (8.0 / 9.0) * np.pi * (sig_by_cutoff9 - 3.0 * sig_by_cutoff3)
+        if self.backend is None:
+            return
+        if self.backend == 'cell':
+            self.box1.build_cell_list(cutoff)
+        if self.backend == 'verlet':
+            self.build_neighbor_list()
+        if self.particle_energies is not None:
+            self.build_energy_cache()
+
+    def set_lj_table(self, lj_table):
+        """
+        Selects between the analytic and the tabulated Lennard Jones potential for every energy backend.
+
+        Parameters
+        ----------
+        lj_table : LennardJonesTable or None
+            Table of the potential covering at least the cutoff, or None for the analytic potential.
+        """
+        if lj_table is not None and lj_table.cutoff < self.cutoff:
+            raise ValueError("The Lennard Jones table ends at %g, before the cutoff %g"
+                             % (lj_table.cutoff, self.cutoff))
+        self.lj_table = lj_table
+        if lj_table is None:
+            self.table_arguments = (_NO_TABLE, 0.0, 0.0)
+        else:
+            self.table_arguments = (lj_table.coefficients, lj_table.r2_min, lj_table.inverse_spacing)
+
+    def set_backend(self, backend):
+        """
+        Selects the energy backend and builds the spatial index it needs.
+
+        Parameters
+        ----------
+        backend : string
+            One of 'python', 'numpy', 'numba', 'cell', 'verlet' or 'auto'. 'auto' selects the compiled 'numba'
+            backend when numba is importable and the box is orthorhombic, and falls back to 'numpy' otherwise.
+        """
+        if backend == 'auto':
+            backend = 'numba' if NUMBA_AVAILABLE and self.box1.orthorhombic else 'numpy'
+        if backend not in BACKENDS:
+            raise ValueError("backend must be 'auto' or one of %s, got %r" % (', '.join(BACKENDS), backend))
+        if backend == 'numba' and not NUMBA_AVAILABLE:
+            raise ImportError("The 'numba' backend requires numba to be installed")
+        if backend == 'numba' and not self.box1.orthorhombic:
+            raise ValueError("The 'numba' backend only supports orthorhombic boxes")
+        self.backend = backend
+        if backend == 'cell' and (self.box1.cell_members is None or
+                                  np.min(self.box1.widths / self.box1.cells_per_side) < self.cutoff):
+            self.box1.build_cell_list(self.cutoff)
+        elif backend == 'verlet':
+            self.build_neighbor_list()
+
+    def build_neighbor_list(self):
+        """
+        Builds the Verlet neighbor list of all pairs closer than cutoff + skin.
+
+        The pairs are found through a cell list of width cutoff + skin on the box. The partners of particle i are
+        stored contiguously in neighbor_indices[neighbor_start[i]:neighbor_start[i + 1]].
+        """
+        coordinates = self.box1.coordinates
+        list_cutoff2 = (self.cutoff + self.skin)**2
+        self.box1.build_cell_list(self.cutoff + self.skin)
+        cell_arrays = [np.array(members, dtype=int) for members in self.box1.cell_members]
+        pairs_i = []
+        pairs_j = []
+        for i_cell, i_members in enumerate(cell_arrays):
+            if len(i_members) == 0:
+                continue
+            j_members = np.concatenate([cell_arrays[j_cell] for j_cell in self.box1.cell_neighbors[i_cell]])
+            rij = coordinates[i_members, np.newaxis, :] - coordinates[np.newaxis, j_members, :]
+            self.box1.minimum_image(rij, out=rij)
+            rij2 = np.einsum('ijk,ijk->ij', rij, rij, dtype=float)
+            i_pair, j_pair = np.nonzero((i_members[:, np.newaxis] != j_members[np.newaxis, :]) & (rij2 < list_cutoff2))
+            pairs_i.append(i_members[i_pair])
+            pairs_j.append(j_members[j_pair])
+        pairs_i = np.concatenate(pairs_i) if pairs_i else np.zeros(0, dtype=int)
+        pairs_j = np.concatenate(pairs_j) if pairs_j else np.zeros(0, dtype=int)
+        order = np.lexsort((pairs_j, pairs_i))
+        self.neighbor_indices = np.ascontiguousarray(pairs_j[order])
+        self.neighbor_start = np.zeros(len(coordinates) + 1, dtype=int)
+        np.cumsum(np.bincount(pairs_i, minlength=len(coordinates)), out=self.neighbor_start[1:])
+        self.reference_coordinates = coordinates.copy()
+        self.n_rebuilds += 1
+
+    def displacement_since_rebuild(self, i_particle, position=None):
+        """
+        Computes how far a particle has moved since the neighbor list was last rebuilt.
+
+        Parameters
+        ----------
+        i_particle : integer
+            Particle whose displacement is computed.
+        position : np.array(3). Default is None.
+            Trial position of particle i. If None, the stored coordinates of particle i are used.
+
+        Returns
+        -------
+        displacement : float
+            Minimum image distance between the position and the reference position of particle i.
+        """
+        if position is None:
+            position = self.box1.coordinates[i_particle]
+        return np.sqrt(self.box1.minimum_image_distance(position, self.reference_coordinates[i_particle],
+                                                        self.box1.box_length))
+
+    @property
+    def average_neighbors(self):
+        """ Property decorator function which calculates the average length of the Verlet neighbor lists.
+
+        Returns
+        -------
+        average_neighbors : float
+            Average number of partners stored per particle, None if no neighbor list is built.
+        """
+        if self.neighbor_indices is None:
+            return None
+        return len(self.neighbor_indices) / max(len(self.neighbor_start) - 1, 1)
+
+    def move_particle(self, i_particle, position, new_pair_energies=None):
+        """
+        Places a particle at a new position, keeping the spatial indices of the selected backend up to date.
+
+        Parameters
+        ----------
+        i_particle : integer
+            Particle to move.
+        position : np.array(3)
+            New position of the particle.
+        new_pair_energies : tuple(np.array, np.array). Default is None.
+            Partners and pair energies of particle i at the new position, as returned by get_pair_energies(). If None,
+            they are recomputed when the per-particle energy cache is built.
+        """
+        self.check_indices()
+        if self.particle_energies is not None:
+            old_partners, old_pair_energies = self.get_pair_energies(i_particle)
+        self.box1.move_particle(i_particle, position)
+        if self.backend == 'verlet' and self.displacement_since_rebuild(i_particle) > 0.5 * self.skin:
+            self.build_neighbor_list()
+        if self.particle_energies is not None:
+            if new_pair_energies is None:
+                new_partners, new_pair_energies = self.get_pair_energies(i_particle)
+            else:
+                new_partners, new_pair_energies = new_pair_energies
+            np.subtract.at(self.particle_energies, old_partners, old_pair_energies)
+            np.add.at(self.particle_energies, new_partners, new_pair_energies)
+            self.particle_energies[i_particle] = np.sum(new_pair_energies)
+            self.n_cached_moves += 1
+            if self.cache_check_frequency and self.n_cached_moves % self.cache_check_frequency == 0:
+                self.check_energy_cache()
+
+    def propose_move(self, i_particle, displacement):
+        """
+        Proposes a trial displacement of one particle. The stored coordinates are left untouched.
+
+        Parameters
+        ----------
+        i_particle : integer
+            Particle to displace.
+        displacement : np.array(3)
+            Trial displacement of the particle.
+        """
+        self.trial_particle = i_particle
+        self.trial_position = self.box1.coordinates[i_particle] + displacement
+        self.trial_pair_energies = None
+
+    def evaluate_move(self):
+        """
+        Computes the energy change of the proposed move.
+
+        Returns
+        -------
+        delta_e : float
+            Energy of the particle at its trial position minus its energy at its stored position.
+        """
+        current_energy = self.get_particle_energy(self.trial_particle)
+        if self.particle_energies is not None:
+            self.trial_pair_energies = self.get_pair_energies(self.trial_particle, self.trial_position)
+            proposed_energy = np.sum(self.trial_pair_energies[1])
+        else:
+            proposed_energy = self.get_particle_energy(self.trial_particle, self.trial_position)
+        self.trial_delta_e = proposed_energy - current_energy
+        return self.trial_delta_e
+
+    def accept_move(self):
+        """
+        Accepts the proposed move: only the row of the moved particle is updated in place, and the total pair
+        energy is shifted by the energy change of the move.
+        """
+        self.move_particle(self.trial_particle, self.trial_position, self.trial_pair_energies)
+        self.total_pair_energy += self.trial_delta_e
+        self.reject_move()
+
+    def reject_move(self):
+        """
+        Discards the proposed move.
+        """
+        self.trial_particle = None
+        self.trial_position = None
+        self.trial_pair_energies = None
+
+    def get_pair_energies(self, i_particle, position=None):
+        """
+        Computes the pair energies between a particle and each of its candidate partners.
+
+        The candidate partners are all the other particles for the 'python' and 'numpy' backends, the particles in
+        the 27 neighboring cells for the 'cell' backend and the Verlet neighbor list for the 'verlet' backend.
+
+        Parameters
+        ----------
+        i_particle : integer
+            Particle whose pair energies are computed.
+        position : np.array(3). Default is None.
+            Trial position of particle i. If None, the stored coordinates of particle i are used.
+
+        Returns
+        -------
+        partners : np.array
+            Indices of the candidate partners of particle i.
+        e_pairs : np.array
+            Lennard Jones energy of each pair, zero beyond the cutoff.
+        """
+        self.check_indices()
+        coordinates = self.box1.coordinates
+        if self.backend == 'verlet' and (position is None or
+                                         self.displacement_since_rebuild(i_particle, position) <= 0.5 * self.skin):
+            partners = self.neighbor_indices[self.neighbor_start[i_particle]:self.neighbor_start[i_particle + 1]]
+        elif self.backend in ('cell', 'verlet'):
+            partners = self.box1.get_neighbor_particles(coordinates[i_particle] if position is None else position)
+            partners = partners[partners != i_particle]
+        else:
+            partners = np.delete(np.arange(len(coordinates)), i_particle)
+        if position is None:
+            position = coordinates[i_particle]
+        else:
+            position = np.asarray(position, dtype=coordinates.dtype)
+        rij = coordinates[partners] - position
+        self.box1.minimum_image(rij, out=rij)
+        rij2 = np.einsum('ij,ij->i', rij, rij, dtype=float)
+        e_pairs = np.zeros(len(partners))
+        within_cutoff = rij2 < self.cutoff2
+        e_pairs[within_cutoff] = self.lennard_jones_potential(rij2[within_cutoff])
+        return partners, e_pairs
+
+    def calculate_particle_energies(self):
+        """
+        Computes the energy of every particle with respect to the rest of the system.
+
+        Returns
+        -------
+        particle_energies : np.array(num_particles)
+            Energy of each particle. Their sum is twice the total pair energy.
+        """
+        particle_energies = np.zeros(len(self.box1.coordinates))
+        for i_particle in range(len(particle_energies)):
+            partners, e_pairs = self.get_pair_energies(i_particle)
+            particle_energies[i_particle] = np.sum(e_pairs)
+        return particle_energies
+
+    def build_energy_cache(self):
+        """
+        Fills the per-particle energy cache. Once it is built, get_particle_energy() looks up the energy of a
+        particle at its stored position and move_particle() updates only the moved particle and its partners.
+        """
+        self.particle_energies = self.calculate_particle_energies()
+        self.n_cached_moves = 0
+        self.cache_drift = 0.0
+
+    def check_energy_cache(self, tolerance=1e-8):
+        """
+        Compares the per-particle energy cache against a full recompute and warns about any drift.
+
+        Parameters
+        ----------
+        tolerance : float
+            Largest absolute difference between cached and recomputed energies that is not reported.
+
+        Returns
         -------
-        num_particles=number of particles in the simulation box : integer
+        drift : float
+            Largest absolute difference between cached and recomputed energies.
         """
-        if (isinstance(self.coordinates,type(None))):
-            return None
-        else:
-            return len(self.coordinates)
-
-    #self.box_length=np.cbrt(self.num_particles / reduced_density)
-            
-class MCState:
-    def __init__(self,box1,cutoff):
-        self.box1=box1
-        self.cutoff=cutoff
-        self.total_pair_energy=0.0
-        self.particle_energy=0.0
-        self.tail_correction=0.0
-        self.unit_energy=0.0
+        drift = float(np.max(np.abs(self.particle_energies - self.calculate_particle_energies()), initial=0.0))
+        self.cache_drift = drift
+        if drift > tolerance:
+            warnings.warn("Per-particle energy cache drifted by %g from a full recompute" % drift, RuntimeWarning)
+        return drift
     
     def calculate_total_pair_energy(self):
         """Computes the total energy of the system.
@@ -110,16 +1130,141 @@ class MCState:
         e_total : float
             Total energy of the system.
         """
+        self.check_indices()
+        if self.backend in ('numpy', 'numba'):
+            self.total_pair_energy = self.calculate_total_pair_energy_tiled()
+            return self.total_pair_energy
+        elif self.backend == 'cell':
+            self.total_pair_energy = self.calculate_total_pair_energy_cell()
+            return self.total_pair_energy
+        elif self.backend == 'verlet':
+            self.total_pair_energy = self.calculate_total_pair_energy_verlet()
+            return self.total_pair_energy
         self.total_pair_energy=0.0
-        particle_count = len(self.box1.coordinates)
+        coordinates = self.box1.coordinates
+        box_length = self.box1.box_length
+        cutoff2 = self.cutoff2
+        particle_count = self.box1.num_particles
         for i_particle in range(particle_count):
             for j_particle in range(i_particle):
-                r_i = self.box1.coordinates[i_particle]
-                r_j = self.box1.coordinates[j_particle]
-                rij2 = self.box1.minimum_image_distance(r_i, r_j, self.box1.box_length)
-                if rij2 < self.cutoff**2:
+                r_i = coordinates[i_particle]
+                r_j = coordinates[j_particle]
+                rij2 = self.box1.minimum_image_distance(r_i, r_j, box_length)
+                if rij2 < cutoff2:
                     self.total_pair_energy += self.lennard_jones_potential(rij2)
         return self.total_pair_energy
+
+    def calculate_total_pair_energy_numpy(self, first_row=0, last_row=None):
+        """Computes the total energy of the system with whole-array NumPy operations.
+
+        The i>j pair matrix is processed in blocks of rows so that no more than ``block_size``
+        pair distances are held in memory at once.
+
+        Parameters
+        ----------
+        first_row : integer
+            First particle i of the rows of the pair matrix to sum.
+        last_row : integer. Default is None.
+            Particle following the last row to sum. If None, the rows up to the last particle are summed.
+
+        Returns
+        -------
+        e_total : float
+            Total energy of the pairs (i, j) with j < i and first_row <= i < last_row, that is of the whole system
+            for the default rows.
+        """
+        coordinates = self.box1.coordinates
+        cutoff2 = self.cutoff2
+        particle_count = len(coordinates)
+        if last_row is None:
+            last_row = particle_count
+        rows_per_block = max(1, self.block_size // max(particle_count, 1))
+        e_total = 0.0
+        for start in range(max(first_row, 1), last_row, rows_per_block):
+            stop = min(start + rows_per_block, last_row)
+            rij = coordinates[start:stop, np.newaxis, :] - coordinates[np.newaxis, :stop - 1, :]
+            self.box1.minimum_image(rij, out=rij)
+            rij2 = np.einsum('ijk,ijk->ij', rij, rij, dtype=float)
+            lower = np.arange(stop - 1)[np.newaxis, :] < np.arange(start, stop)[:, np.newaxis]
+            e_total += np.sum(self.lennard_jones_potential(rij2[lower & (rij2 < cutoff2)]))
+        return float(e_total)
+
+    def calculate_total_pair_energy_tiled(self):
+        """Computes the total energy of the system as a sum over row tiles of the pair matrix.
+
+        The tiles hold at most block_size pairs each and do not depend on n_threads. When n_threads is larger than
+        one, the tiles are evaluated on a thread pool; the NumPy and numba kernels release the GIL while they run.
+        The partial sums are always added in tile order, so the result is the same whatever the number of threads.
+
+        Returns
+        -------
+        e_total : float
+            Total energy of the system.
+        """
+        particle_count = len(self.box1.coordinates)
+        rows_per_block = max(1, self.block_size // max(particle_count, 1))
+        first_rows = list(range(1, particle_count, rows_per_block))
+        last_rows = [min(first_row + rows_per_block, particle_count) for first_row in first_rows]
+        if self.backend == 'numba':
+            coordinates = self.box1.coordinates
+            box_lengths = self.box1.lengths
+            cutoff2 = self.cutoff2
+            table_arguments = self.table_arguments
+
+            def tile_energy(first_row, last_row):
+                return _total_pair_energy_kernel(coordinates, box_lengths, cutoff2, first_row, last_row,
+                                                 *table_arguments)
+        else:
+            tile_energy = self.calculate_total_pair_energy_numpy
+        if self.n_threads > 1 and len(first_rows) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+                partial_sums = list(executor.map(tile_energy, first_rows, last_rows))
+        else:
+            partial_sums = [tile_energy(first_row, last_row) for first_row, last_row in zip(first_rows, last_rows)]
+        e_total = 0.0
+        for partial_sum in partial_sums:
+            e_total += partial_sum
+        return float(e_total)
+
+    def calculate_total_pair_energy_cell(self):
+        """Computes the total energy of the system by visiting, for each cell, only its 27 neighboring cells.
+
+        Returns
+        -------
+        e_total : float
+            Total energy of the system.
+        """
+        coordinates = self.box1.coordinates
+        cutoff2 = self.cutoff2
+        cell_arrays = [np.array(members, dtype=int) for members in self.box1.cell_members]
+        e_total = 0.0
+        for i_cell, i_members in enumerate(cell_arrays):
+            if len(i_members) == 0:
+                continue
+            j_members = np.concatenate([cell_arrays[j_cell] for j_cell in self.box1.cell_neighbors[i_cell]])
+            rij = coordinates[i_members, np.newaxis, :] - coordinates[np.newaxis, j_members, :]
+            self.box1.minimum_image(rij, out=rij)
+            rij2 = np.einsum('ijk,ijk->ij', rij, rij, dtype=float)
+            mask = (i_members[:, np.newaxis] > j_members[np.newaxis, :]) & (rij2 < cutoff2)
+            e_total += np.sum(self.lennard_jones_potential(rij2[mask]))
+        return float(e_total)
+
+    def calculate_total_pair_energy_verlet(self):
+        """Computes the total energy of the system from the pairs stored in the Verlet neighbor list.
+
+        Returns
+        -------
+        e_total : float
+            Total energy of the system.
+        """
+        coordinates = self.box1.coordinates
+        pairs_i = np.repeat(np.arange(len(coordinates)), np.diff(self.neighbor_start))
+        pairs_j = self.neighbor_indices
+        lower = pairs_i > pairs_j
+        rij = coordinates[pairs_i[lower]] - coordinates[pairs_j[lower]]
+        self.box1.minimum_image(rij, out=rij)
+        rij2 = np.einsum('ij,ij->i', rij, rij, dtype=float)
+        return float(np.sum(self.lennard_jones_potential(rij2[rij2 < self.cutoff2])))
         
     def calculate_tail_correction(self):
         """
@@ -140,10 +1285,8 @@ class MCState:
             Energy correction term to compensate for Lennard Jones cutoff.
         """
 
-        sig_by_cutoff3 = np.power(1.0 / self.cutoff, 3)
-        sig_by_cutoff9 = np.power(sig_by_cutoff3, 3)
-        self.tail_correction = sig_by_cutoff9 - 3.0 * sig_by_cutoff3
-        self.tail_correction *= (8.0 / 9.0) * np.pi * self.box1.num_particles * self.box1.num_particles/ self.box1.volume
+        num_particles = self.box1.num_particles
+        self.tail_correction = self.tail_prefactor * num_particles * num_particles / self.box1.volume
         return self.tail_correction
 
     def calculate_unit_energy(self):
@@ -166,7 +1309,7 @@ class MCState:
         self.unit_energy = (self.total_pair_energy + self.tail_correction)/self.box1.num_particles
         return self.unit_energy
     
-    def get_particle_energy(self, i_particle):
+    def get_particle_energy(self, i_particle, position=None):
         """
         Computes the energy of a particle with respect to the rest of the system.
     
@@ -178,6 +1321,9 @@ class MCState:
             Side of cubic simulation box.
         i_particle : integer
             Particle whose energy is computed.
+        position : np.array(3). Default is None.
+            Trial position of particle i. If None, the stored coordinates of particle i are used, and the energy is
+            looked up when the per-particle energy cache is built.
         cutoff2: float 
             Square of cutoff value for Lennard Jones potential.
         
@@ -186,17 +1332,128 @@ class MCState:
         e_total : float
             Total energy of particle_i.
         """
+        self.check_indices()
+        if position is None and self.particle_energies is not None:
+            self.particle_energy = self.particle_energies[i_particle]
+            return self.particle_energy
+        if self.backend == 'numpy':
+            self.particle_energy = self.get_particle_energy_numpy(i_particle, position)
+            return self.particle_energy
+        elif self.backend == 'numba':
+            coordinates = self.box1.coordinates
+            position = coordinates[i_particle] if position is None else np.asarray(position, dtype=coordinates.dtype)
+            self.particle_energy = _particle_energy_kernel(coordinates, i_particle, position, self.box1.lengths,
+                                                           self.cutoff2, *self.table_arguments)
+            return self.particle_energy
+        elif self.backend == 'cell':
+            self.particle_energy = self.get_particle_energy_cell(i_particle, position)
+            return self.particle_energy
+        elif self.backend == 'verlet':
+            self.particle_energy = self.get_particle_energy_verlet(i_particle, position)
+            return self.particle_energy
         self.particle_energy = 0.0
-        i_position = self.box1.coordinates[i_particle]
-        particle_count = len(self.box1.coordinates)
+        coordinates = self.box1.coordinates
+        box_length = self.box1.box_length
+        cutoff2 = self.cutoff2
+        if position is None:
+            i_position = coordinates[i_particle]
+        else:
+            i_position = position
+        particle_count = self.box1.num_particles
         for j_particle in range(particle_count):
             if i_particle != j_particle:
-                j_position = self.box1.coordinates[j_particle]
-                rij2 = self.box1.minimum_image_distance(i_position, j_position, self.box1.box_length)
-                if rij2 < self.cutoff**2:
+                j_position = coordinates[j_particle]
+                rij2 = self.box1.minimum_image_distance(i_position, j_position, box_length)
+                if rij2 < cutoff2:
                     e_pair = self.lennard_jones_potential(rij2) 
                     self.particle_energy += e_pair
         return self.particle_energy
+
+    def get_particle_energy_numpy(self, i_particle, position=None):
+        """
+        Computes the energy of a particle with respect to the rest of the system in a single NumPy pass.
+
+        Parameters
+        ----------
+        i_particle : integer
+            Particle whose energy is computed.
+        position : np.array(3). Default is None.
+            Trial position of particle i. If None, the stored coordinates of particle i are used.
+
+        Returns
+        -------
+        e_total : float
+            Total energy of particle_i.
+        """
+        coordinates = self.box1.coordinates
+        if position is None:
+            position = coordinates[i_particle]
+        else:
+            position = np.asarray(position, dtype=coordinates.dtype)
+        rij = coordinates - position
+        self.box1.minimum_image(rij, out=rij)
+        rij2 = np.einsum('ij,ij->i', rij, rij, dtype=float)
+        mask = rij2 < self.cutoff2
+        mask[i_particle] = False
+        return float(np.sum(self.lennard_jones_potential(rij2[mask])))
+
+    def get_particle_energy_cell(self, i_particle, position=None):
+        """
+        Computes the energy of a particle with respect to the particles in its 27 neighboring cells.
+
+        Parameters
+        ----------
+        i_particle : integer
+            Particle whose energy is computed.
+        position : np.array(3). Default is None.
+            Trial position of particle i. If None, the stored coordinates of particle i are used.
+
+        Returns
+        -------
+        e_total : float
+            Total energy of particle_i.
+        """
+        if position is None:
+            position = self.box1.coordinates[i_particle]
+        else:
+            position = np.asarray(position, dtype=self.box1.dtype)
+        neighbors = self.box1.get_neighbor_particles(position)
+        neighbors = neighbors[neighbors != i_particle]
+        rij = self.box1.coordinates[neighbors] - position
+        self.box1.minimum_image(rij, out=rij)
+        rij2 = np.einsum('ij,ij->i', rij, rij, dtype=float)
+        return float(np.sum(self.lennard_jones_potential(rij2[rij2 < self.cutoff2])))
+
+    def get_particle_energy_verlet(self, i_particle, position=None):
+        """
+        Computes the energy of a particle with respect to the partners in its Verlet neighbor list.
+
+        A trial position farther than skin/2 from the reference position is not covered by the list, so its energy
+        is computed from the cell list instead.
+
+        Parameters
+        ----------
+        i_particle : integer
+            Particle whose energy is computed.
+        position : np.array(3). Default is None.
+            Trial position of particle i. If None, the stored coordinates of particle i are used.
+
+        Returns
+        -------
+        e_total : float
+            Total energy of particle_i.
+        """
+        if position is not None and self.displacement_since_rebuild(i_particle, position) > 0.5 * self.skin:
+            return self.get_particle_energy_cell(i_particle, position)
+        if position is None:
+            position = self.box1.coordinates[i_particle]
+        else:
+            position = np.asarray(position, dtype=self.box1.dtype)
+        neighbors = self.neighbor_indices[self.neighbor_start[i_particle]:self.neighbor_start[i_particle + 1]]
+        rij = self.box1.coordinates[neighbors] - position
+        self.box1.minimum_image(rij, out=rij)
+        rij2 = np.einsum('ij,ij->i', rij, rij, dtype=float)
+        return float(np.sum(self.lennard_jones_potential(rij2[rij2 < self.cutoff2])))
     
     def lennard_jones_potential(self, rij2):
         """
@@ -212,44 +1469,169 @@ class MCState:
         Lennard Jones potential : float
             Lennard Jones potential between an atom pair.    
         """
-        
+        if self.lj_table is not None:
+            return self.lj_table(rij2)
         sig_by_r6 = np.power(1 / rij2, 3)
         sig_by_r12 = np.power(sig_by_r6, 2)
         return 4.0 * (sig_by_r12  - sig_by_r6)
     
-def generate_initial_state(method = 'random', file_name = None, num_particles = None, box_length = None):
+def spawn_generators(seed, n_streams):
+    """
+    Spawns statistically independent random number generators from a single seed.
+
+    The streams are derived with SeedSequence.spawn, so the i-th generator is the same every time the function is
+    called with the same seed, whatever the number of streams or the process it is used in.
+
+    Parameters
+    ----------
+    seed : integer, np.random.SeedSequence or None
+        Root seed of the streams. If None, fresh entropy is drawn from the operating system.
+    n_streams : integer
+        Number of independent generators to create.
+
+    Returns
+    -------
+    generators : list of np.random.Generator
+        Independent random number generators.
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return [np.random.default_rng(child) for child in seed.spawn(n_streams)]
+
+def parse_box_length(comment):
+    """
+    Parses the box length from the comment line of an XYZ frame.
+
+    Parameters
+    ----------
+    comment : string
+        Second line of an XYZ frame, e.g. '10.0 10.0 10.0', or the nine entries of the cell matrix, row by row.
+
+    Returns
+    -------
+    box_length : float, np.array(3), np.array(3,3) or None
+        Side of the cubic box if the comment holds one length or three equal lengths, the three lengths if they
+        differ, the cell matrix if the comment holds nine numbers that are not a diagonal matrix, or None if the
+        comment holds no numbers.
+    """
+    lengths = []
+    for token in comment.split():
+        try:
+            lengths.append(float(token))
+        except ValueError:
+            return None
+    if len(lengths) == 0:
+        return None
+    if len(lengths) == 9:
+        cell = np.array(lengths).reshape(3, 3)
+        if np.count_nonzero(cell - np.diag(np.diag(cell))) != 0:
+            return cell
+        lengths = list(np.diag(cell))
+    if len(lengths) == 1 or (len(lengths) == 3 and lengths[0] == lengths[1] == lengths[2]):
+        return lengths[0]
+    return np.array(lengths)
+
+def read_xyz_frames(file_name):
+    """
+    Reads the frames of an XYZ file one at a time.
+
+    Each frame is the number of atoms, a comment line holding the box length, and one line per atom with its element
+    and x, y and z coordinates. The atom lines of a frame are handed to np.loadtxt as one chunk, so only one frame is
+    held in memory and the element column is never converted.
+
+    Parameters
+    ----------
+    file_name : string
+        XYZ file with one or more frames.
+
+    Returns
+    -------
+    frames : generator
+        Generator of (coordinates, box_length) tuples, where coordinates is a np.array(num_particles,3) and
+        box_length is given by parse_box_length().
+    """
+    with open(file_name, 'r') as handle:
+        for line in handle:
+            if line.strip() == '':
+                continue
+            num_particles = int(line)
+            box_length = parse_box_length(next(handle, ''))
+            coordinates = np.loadtxt(itertools.islice(handle, num_particles), usecols=(1, 2, 3), comments=None,
+                                     ndmin=2)
+            if coordinates.shape[0] != num_particles:
+                raise ValueError("%s: frame with %d atoms ends after %d atoms" % (file_name, num_particles,
+                                                                                  coordinates.shape[0]))
+            yield coordinates, box_length
+
+def read_xyz(file_name):
+    """
+    Reads the first frame of an XYZ file.
+
+    Parameters
+    ----------
+    file_name : string
+        XYZ file to read.
+
+    Returns
+    -------
+    coordinates : np.array(num_particles,3)
+        A numpy array with the x, y and z coordinates of each atom in the simulation box.
+    box_length : float, np.array(3) or None
+        Box length given on the comment line, or None if there is none.
+    """
+    with open(file_name, 'r') as handle:
+        num_particles = int(handle.readline())
+        box_length = parse_box_length(handle.readline())
+    # np.loadtxt reads a file name in large chunks, which is faster than feeding it lines from a Python iterator.
+    coordinates = np.loadtxt(file_name, skiprows = 2, max_rows = num_particles, usecols = (1, 2, 3), comments = None,
+                             ndmin = 2)
+    return coordinates, box_length
+
+def generate_initial_state(method = 'random', file_name = None, num_particles = None, box_length = None, rng = None):
     """ 
     Generates initial state of the system.
 
-    Generates the initial coordinates of all the atoms in the simulation box. If the method is random, the atoms are assigned a random set of coordinates.
-    If method is file, coordinates are loaded from a file.
+    Generates the initial coordinates of all the atoms in the simulation box. If the method is random, the atoms are
+    assigned a random set of coordinates. If method is file, coordinates are loaded from the first frame of an XYZ
+    file; use read_xyz() to also get the box length.
 
     Parameters
     ----------
     method : string. Either 'random' or 'file'.
-        Flag which is either set to random or file depending on whether we need random coordinates or load coordinates from a file.
+        Flag which is either set to random or file depending on whether we need random coordinates or load
+        coordinates from a file.
     file_name :  string. Default is None.
         File name to load coordinates from if method is file.
     num_particles : integer. Default is none.
         Number of particles in the simulation box.
-    box_length : float. Default is None
-        Side of cubic simulation box.
+    box_length : float, np.array(3) or np.array(3,3). Default is None
+        Side of cubic simulation box, edge lengths of an orthorhombic box or cell matrix of a triclinic box.
+    rng : np.random.Generator or integer seed. Default is None.
+        Random number generator used by the random method. If None, the global np.random state is used.
     
     Returns
     -------
     coordinates : np.array(num_particles,3)
         A numpy array with the x, y and z coordinates of each atom in the simulation box.
     """
-    if method is 'random':
-        coordinates = (0.5 - np.random.rand(num_particles, 3)) * box_length
+    if method == 'random':
+        if rng is None:
+            fractional = 0.5 - np.random.rand(num_particles, 3)
+        else:
+            fractional = 0.5 - np.random.default_rng(rng).random((num_particles, 3))
+        if np.shape(box_length) == (3, 3):
+            coordinates = fractional @ np.asarray(box_length, dtype=float)
+        else:
+            coordinates = fractional * box_length
     
-    elif method is 'file':
-        coordinates = np.loadtxt(file_name, skiprows = 2, usecols=(1, 2, 3))
+    elif method == 'file':
+        coordinates, box_length = read_xyz(file_name)
     return coordinates
 
-def accept_or_reject(delta_e, beta):
+def accept_or_reject(delta_e, beta, random_number=None, rng=None):
     """
-    Accepts or rejects a move based on the energy difference between initial and updated state along with system temperature.
+    Accepts or rejects a move based on the energy difference between initial and updated state along with system
+    temperature.
     
     Parameters
     ----------
@@ -257,6 +1639,11 @@ def accept_or_reject(delta_e, beta):
         Energy difference between initial and updated state of the system.
     beta : float
         Inverse reduced temperature, a general constant in canonical ensemble.
+    random_number : float. Default is None.
+        Uniform random number in [0, 1) compared to the acceptance probability. If None, a new one is drawn.
+    rng : np.random.Generator. Default is None.
+        Random number generator used to draw the random number. If None, the global np.random state is used. An
+        integer seed is refused, since seeding a new generator on every call would draw the same number every time.
 
     Returns
     -------
@@ -264,11 +1651,16 @@ def accept_or_reject(delta_e, beta):
         If true, trial move is accepted, else it is rejected.
 
     """
+    if rng is not None and not isinstance(rng, np.random.Generator):
+        raise TypeError("rng must be a np.random.Generator, got %s" % (type(rng).__name__,))
     if delta_e < 0.0:
         accept = True
     
     else:
-        random_number = np.random.rand(1)
+        if random_number is None and rng is None:
+            random_number = np.random.rand(1)
+        elif random_number is None:
+            random_number = rng.random()
         p_acc = np.exp(-beta * delta_e)
         if random_number < p_acc:
             accept = True
@@ -279,7 +1671,9 @@ def accept_or_reject(delta_e, beta):
 def adjust_displacement(n_trials, n_accept, max_displacement):
     """Adjusts the maximum value allowed for a displacement move.
     
-    This function adjusts the maximum displacement to obtain a suitable acceptance of trial moves. That is, when the acceptance is too high, the maximum displacement is increased and when the acceptance is too low, the maximum displacement is decreased.
+    This function adjusts the maximum displacement to obtain a suitable acceptance of trial moves. That is, when the
+    acceptance is too high, the maximum displacement is increased and when the acceptance is too low, the maximum
+    displacement is decreased.
     
     Parameters
     ----------
@@ -309,7 +1703,527 @@ def adjust_displacement(n_trials, n_accept, max_displacement):
     n_trials = 0
     n_accept = 0
     return max_displacement, n_trials, n_accept
-    
+
+def print_progress(simulation):
+    """
+    Output sink printing the number of steps performed and the current unit energy.
+
+    Parameters
+    ----------
+    simulation : Simulation
+        Simulation being reported.
+    """
+    print(simulation.n_steps_done, simulation.mcs.unit_energy)
+
+class SimulationTerminated(Exception):
+    """
+    Raised by Simulation.run() after it wrote a checkpoint in answer to a termination request, such as SIGTERM.
+
+    Parameters
+    ----------
+    checkpoint_file : string
+        Checkpoint written before the run stopped, from which resume() continues the simulation.
+    energy_array : np.array(n_steps_run)
+        The total unit energy per particle after each step performed before the run stopped.
+    """
+    def __init__(self, checkpoint_file, energy_array):
+        super().__init__("Simulation terminated on request, checkpoint written to %s" % (checkpoint_file,))
+        self.checkpoint_file = checkpoint_file
+        self.energy_array = energy_array
+
+class Simulation:
+    """
+    Metropolis Monte Carlo engine for Lennard Jones particles.
+
+    The engine owns the MCState (and through it the Box), the random number source, the step size and the output
+    sinks. Each step displaces one random particle through the trial move API of MCState, so no objects are created
+    in the hot loop.
+
+    Parameters
+    ----------
+    mcs : MCState
+        State of the system to simulate.
+    reduced_temperature : float
+        Reduced temperature of the canonical ensemble.
+    max_displacement : float
+        Initial maximum displacement allowed for any step in the simulation.
+    tune_displacement : boolean
+        If true, the maximum displacement is adjusted every freq steps.
+    freq : integer
+        Number of steps between two calls to the output sinks.
+    sinks : list of callables. Default is [print_progress].
+        Functions called with the simulation every freq steps.
+    rng : np.random.Generator or integer seed. Default is None.
+        Random number generator. If None, a new one is created from seed.
+    seed : integer. Default is None.
+        Seed of the random number generator created when rng is None.
+    batch_size : integer
+        Number of steps whose random numbers are drawn at once.
+    acceptance : callable. Default is accept_or_reject.
+        Function deciding whether a move with energy change delta_e is accepted at inverse temperature beta, given
+        a uniform random number.
+    adjustment : callable. Default is adjust_displacement.
+        Function tuning the maximum displacement from the number of trials and accepted moves.
+    writers : list of callables. Default is None.
+        Trajectory sinks, such as TrajectoryWriter, each called with the simulation every writer.frequency steps.
+    checkpoint_file : string. Default is None.
+        File to which write_checkpoint() saves the simulation.
+    checkpoint_frequency : integer. Default is None.
+        Number of steps between two checkpoints. If None, checkpoints are only written on request and on SIGTERM.
+    initialize_energy : boolean
+        If true, the total pair energy, tail correction and unit energy of mcs are computed. resume() skips this
+        since they are restored from the checkpoint.
+    """
+    def __init__(self, mcs, reduced_temperature, max_displacement=0.1, tune_displacement=True, freq=1000,
+                 sinks=None, rng=None, seed=None, batch_size=4096, acceptance=accept_or_reject,
+                 adjustment=adjust_displacement, writers=None, checkpoint_file=None, checkpoint_frequency=None,
+                 initialize_energy=True):
+        self.mcs = mcs
+        self.box = mcs.box1
+        self.reduced_temperature = reduced_temperature
+        self.beta = 1.0 / reduced_temperature
+        self.max_displacement = max_displacement
+        self.tune_displacement = tune_displacement
+        self.freq = freq
+        self.sinks = [print_progress] if sinks is None else list(sinks)
+        self.rng = np.random.default_rng(seed if rng is None else rng)
+        self.batch_size = batch_size
+        self.random_particles = np.zeros(0, dtype=int)
+        self.random_displacements = np.zeros((0, 3))
+        self.random_uniforms = np.zeros(0)
+        self.i_random = 0
+        self.acceptance = acceptance
+        self.adjustment = adjustment
+        self.num_particles = self.box.num_particles
+        self.n_trials = 0
+        self.n_accept = 0
+        self.n_steps_done = 0
+        self.writers = [] if writers is None else list(writers)
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_frequency = checkpoint_frequency
+        self.terminate_requested = False
+        if initialize_energy:
+            self.mcs.calculate_total_pair_energy()
+            self.mcs.calculate_tail_correction()
+            self.mcs.calculate_unit_energy()
+
+    def draw_random_numbers(self):
+        """
+        Refills the buffers of particle indices, unit displacements and acceptance uniforms for the next batch_size
+        steps.
+
+        Each step uses one row of five uniforms drawn in order from the generator, so the sequence of moves only
+        depends on the seed and not on batch_size.
+        """
+        uniforms = self.rng.random((self.batch_size, 5))
+        self.random_particles = np.minimum((uniforms[:, 0] * self.num_particles).astype(int), self.num_particles - 1)
+        self.random_displacements = 2.0 * uniforms[:, 1:4] - 1.0
+        self.random_uniforms = uniforms[:, 4]
+        self.i_random = 0
+
+    def step(self):
+        """
+        Performs one Metropolis trial move.
+
+        Returns
+        -------
+        unit_energy : float
+            The total unit energy per particle after the step.
+        """
+        if self.i_random == len(self.random_uniforms):
+            self.draw_random_numbers()
+        i_random = self.i_random
+        self.i_random += 1
+        self.n_trials += 1
+        i_particle = self.random_particles[i_random]
+        random_displacement = self.random_displacements[i_random] * self.max_displacement
+        self.mcs.propose_move(i_particle, random_displacement)
+        delta_e = self.mcs.evaluate_move()
+        if self.acceptance(delta_e, self.beta, self.random_uniforms[i_random]):
+            self.mcs.accept_move()
+            self.n_accept += 1
+        else:
+            self.mcs.reject_move()
+        unit_energy = self.mcs.calculate_unit_energy()
+        self.n_steps_done += 1
+
+        for writer in self.writers:
+            if self.n_steps_done % writer.frequency == 0:
+                writer(self)
+        if self.n_steps_done % self.freq == 0:
+            for sink in self.sinks:
+                sink(self)
+            if self.tune_displacement:
+                self.max_displacement, self.n_trials, self.n_accept = self.adjustment(self.n_trials, self.n_accept,
+                                                                                      self.max_displacement)
+        if self.checkpoint_frequency and self.n_steps_done % self.checkpoint_frequency == 0:
+            self.write_checkpoint()
+        return unit_energy
+
+    def run(self, n_steps):
+        """
+        Performs n_steps Metropolis trial moves.
+
+        When a checkpoint file is set and run() is called from the main thread, a SIGTERM received during the run
+        lets the current step finish, writes a checkpoint and raises SimulationTerminated, so the caller decides how
+        to exit.
+
+        Parameters
+        ----------
+        n_steps : integer
+            Number of trial moves to perform.
+
+        Returns
+        -------
+        energy_array : np.array(n_steps)
+            The total unit energy per particle after each step.
+        """
+        energy_array = np.zeros(n_steps)
+        handle_sigterm = self.checkpoint_file is not None and threading.current_thread() is threading.main_thread()
+        if handle_sigterm:
+            previous_handler = signal.signal(signal.SIGTERM, self.request_termination)
+        try:
+            for i_step in range(n_steps):
+                energy_array[i_step] = self.step()
+                if self.terminate_requested:
+                    self.terminate_requested = False
+                    self.write_checkpoint()
+                    raise SimulationTerminated(self.checkpoint_file, energy_array[:i_step + 1])
+        finally:
+            if handle_sigterm:
+                signal.signal(signal.SIGTERM, previous_handler)
+        return energy_array
+
+    def request_termination(self, signal_number=None, frame=None):
+        """
+        Signal handler asking run() to write a checkpoint and stop after the current step.
+        """
+        self.terminate_requested = True
+
+    def write_checkpoint(self, file_name=None):
+        """
+        Saves everything needed to continue the simulation bit-exactly in a binary npz file.
+
+        The file is written next to its final location, flushed to disk and then renamed over it, so a checkpoint is
+        never left half written, even after a crash of the machine. The coordinates, step size, counters, running
+        energies, random number generator state and buffers, per-particle energy cache and neighbor lists are all
+        saved, so resume() does not recompute any energy.
+
+        Parameters
+        ----------
+        file_name : string. Default is None.
+            Checkpoint file. If None, checkpoint_file is used.
+        """
+        file_name = self.checkpoint_file if file_name is None else file_name
+        mcs = self.mcs
+        box = self.box
+        arrays = {
+            'coordinates': box.coordinates,
+            'box_length': box.box_length,
+            'cutoff': mcs.cutoff,
+            'backend': mcs.backend,
+            'block_size': mcs.block_size,
+            'skin': mcs.skin,
+            'n_threads': mcs.n_threads,
+            'total_pair_energy': mcs.total_pair_energy,
+            'tail_correction': mcs.tail_correction,
+            'unit_energy': mcs.unit_energy,
+            'reduced_temperature': self.reduced_temperature,
+            'max_displacement': self.max_displacement,
+            'tune_displacement': self.tune_displacement,
+            'freq': self.freq,
+            'batch_size': self.batch_size,
+            'n_trials': self.n_trials,
+            'n_accept': self.n_accept,
+            'n_steps_done': self.n_steps_done,
+            'checkpoint_frequency': -1 if self.checkpoint_frequency is None else self.checkpoint_frequency,
+            'rng_state': json.dumps(self.rng.bit_generator.state),
+            'random_particles': self.random_particles,
+            'random_displacements': self.random_displacements,
+            'random_uniforms': self.random_uniforms,
+            'i_random': self.i_random,
+        }
+        if mcs.lj_table is not None:
+            table = mcs.lj_table
+            arrays['lj_table'] = json.dumps({'cutoff': table.cutoff, 'r_min': table.r_min, 'n_points': table.n_points,
+                                             'method': table.method})
+        if mcs.particle_energies is not None:
+            arrays['particle_energies'] = mcs.particle_energies
+            arrays['n_cached_moves'] = mcs.n_cached_moves
+            arrays['cache_check_frequency'] = -1 if mcs.cache_check_frequency is None else mcs.cache_check_frequency
+        if box.cell_members is not None:
+            arrays['cells_per_side'] = box.cells_per_side
+            arrays['cell_sizes'] = np.array([len(members) for members in box.cell_members], dtype=int)
+            arrays['cell_particles'] = np.array([i_particle for members in box.cell_members for i_particle in members],
+                                                dtype=int)
+        if mcs.neighbor_indices is not None:
+            arrays['neighbor_start'] = mcs.neighbor_start
+            arrays['neighbor_indices'] = mcs.neighbor_indices
+            arrays['reference_coordinates'] = mcs.reference_coordinates
+            arrays['n_rebuilds'] = mcs.n_rebuilds
+
+        directory = os.path.dirname(os.path.abspath(file_name))
+        descriptor, temporary_name = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as handle:
+                np.savez(handle, **arrays)
+                handle.flush()
+                os.fsync(handle.fileno())
+            os.replace(temporary_name, file_name)
+        except BaseException:
+            os.remove(temporary_name)
+            raise
+        if os.name == 'posix':
+            directory_descriptor = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(directory_descriptor)
+            finally:
+                os.close(directory_descriptor)
+
+def resume(file_name, sinks=None, acceptance=accept_or_reject, adjustment=adjust_displacement, backend=None,
+           writers=None):
+    """
+    Rebuilds a Simulation from a checkpoint written by Simulation.write_checkpoint(), ready to continue exactly
+    where it stopped.
+
+    Parameters
+    ----------
+    file_name : string
+        Checkpoint file. Later checkpoints of the resumed simulation are written to the same file.
+    sinks : list of callables. Default is [print_progress].
+        Output sinks of the resumed simulation.
+    acceptance : callable. Default is accept_or_reject.
+        Acceptance function of the resumed simulation.
+    adjustment : callable. Default is adjust_displacement.
+        Displacement adjustment function of the resumed simulation.
+    backend : string. Default is None.
+        Energy backend of the resumed simulation. If None, the backend of the checkpointed simulation is used.
+    writers : list of callables. Default is None.
+        Trajectory sinks of the resumed simulation.
+
+    Returns
+    -------
+    simulation : Simulation
+        The restored simulation.
+    """
+    with np.load(file_name, allow_pickle=False) as checkpoint:
+        arrays = {key: checkpoint[key] for key in checkpoint.files}
+    saved_backend = str(arrays['backend'])
+    box = Box(arrays['box_length'], arrays['coordinates'], dtype=arrays['coordinates'].dtype)
+    if 'cell_particles' in arrays:
+        box.build_cell_list(None, arrays['cells_per_side'])
+        boundaries = np.cumsum(arrays['cell_sizes'])[:-1]
+        box.cell_members = [members.tolist() for members in np.split(arrays['cell_particles'], boundaries)]
+        for i_cell, members in enumerate(box.cell_members):
+            box.particle_cell[members] = i_cell
+    state_backend = 'numpy' if saved_backend == 'verlet' else saved_backend
+    lj_table = LennardJonesTable(**json.loads(str(arrays['lj_table']))) if 'lj_table' in arrays else None
+    mcs = MCState(box, float(arrays['cutoff']), backend=state_backend if backend is None else backend,
+                  block_size=int(arrays['block_size']), skin=float(arrays['skin']), n_threads=int(arrays['n_threads']),
+                  lj_table=lj_table)
+    if 'neighbor_indices' in arrays:
+        mcs.neighbor_start = arrays['neighbor_start']
+        mcs.neighbor_indices = arrays['neighbor_indices']
+        mcs.reference_coordinates = arrays['reference_coordinates']
+        mcs.n_rebuilds = int(arrays['n_rebuilds'])
+        if backend is None:
+            mcs.backend = saved_backend
+    elif backend is None and saved_backend == 'verlet':
+        mcs.set_backend('verlet')
+    if 'particle_energies' in arrays:
+        mcs.particle_energies = arrays['particle_energies']
+        mcs.n_cached_moves = int(arrays['n_cached_moves'])
+        cache_check_frequency = int(arrays['cache_check_frequency'])
+        mcs.cache_check_frequency = None if cache_check_frequency < 0 else cache_check_frequency
+    mcs.total_pair_energy = float(arrays['total_pair_energy'])
+    mcs.tail_correction = float(arrays['tail_correction'])
+    mcs.unit_energy = float(arrays['unit_energy'])
+
+    rng_state = json.loads(str(arrays['rng_state']))
+    rng = np.random.Generator(getattr(np.random, rng_state['bit_generator'])())
+    rng.bit_generator.state = rng_state
+    checkpoint_frequency = int(arrays['checkpoint_frequency'])
+    simulation = Simulation(mcs, float(arrays['reduced_temperature']),
+                            max_displacement=float(arrays['max_displacement']),
+                            tune_displacement=bool(arrays['tune_displacement']), freq=int(arrays['freq']), sinks=sinks,
+                            rng=rng, batch_size=int(arrays['batch_size']), acceptance=acceptance,
+                            adjustment=adjustment, writers=writers, checkpoint_file=file_name,
+                            checkpoint_frequency=None if checkpoint_frequency < 0 else checkpoint_frequency,
+                            initialize_energy=False)
+    simulation.random_particles = arrays['random_particles']
+    simulation.random_displacements = arrays['random_displacements']
+    simulation.random_uniforms = arrays['random_uniforms']
+    simulation.i_random = int(arrays['i_random'])
+    simulation.n_trials = int(arrays['n_trials'])
+    simulation.n_accept = int(arrays['n_accept'])
+    simulation.n_steps_done = int(arrays['n_steps_done'])
+    return simulation
+
+class ReplicaSimulation:
+    """
+    Metropolis Monte Carlo engine advancing many independent replicas of the same system in one vectorized pass.
+
+    The coordinates of all replicas are stored in a single (num_replicas, num_particles, 3) array, and the Box of
+    each MCState is pointed at its slice, so the MCState methods keep working on every replica. Each step performs
+    one trial move in every replica, with the minimum image, the Lennard Jones energies and the Metropolis test
+    evaluated across the replica axis at once.
+
+    Parameters
+    ----------
+    states : list of MCState
+        One state per replica. All of them must have the same number of particles, box length, cutoff, coordinate
+        dtype and Lennard Jones table, since the replicas are evaluated with the geometry and potential of the first.
+    reduced_temperature : float or np.array(num_replicas)
+        Reduced temperature of each replica.
+    max_displacement : float
+        Initial maximum displacement allowed for any step in the simulation.
+    tune_displacement : boolean
+        If true, the maximum displacement of each replica is adjusted every freq steps.
+    freq : integer
+        Number of steps between two calls to the output sinks.
+    sinks : list of callables. Default is None.
+        Functions called with the simulation every freq steps.
+    rng : np.random.Generator or integer seed. Default is None.
+        Random number generator shared by all replicas.
+    batch_size : integer
+        Number of steps whose random numbers are drawn at once.
+    """
+    def __init__(self, states, reduced_temperature, max_displacement=0.1, tune_displacement=True, freq=1000,
+                 sinks=None, rng=None, batch_size=1024):
+        self.states = list(states)
+        first = self.states[0]
+        box_length = first.box1.box_length
+        cutoff = first.cutoff
+
+        def table_parameters(lj_table):
+            if lj_table is None:
+                return None
+            return (lj_table.cutoff, lj_table.r_min, lj_table.n_points, lj_table.method)
+        for mcs in self.states:
+            if (not np.array_equal(mcs.box1.box_length, box_length) or mcs.cutoff != cutoff
+                    or mcs.box1.num_particles != first.box1.num_particles or mcs.box1.dtype != first.box1.dtype
+                    or table_parameters(mcs.lj_table) != table_parameters(first.lj_table)):
+                raise ValueError("All replicas must share the number of particles, box length, cutoff, coordinate "
+                                 "dtype and Lennard Jones table")
+        self.num_replicas = len(self.states)
+        self.box_length = box_length
+        self.cutoff2 = self.states[0].cutoff2
+        self.coordinates = np.array([mcs.box1.coordinates for mcs in self.states], dtype=self.states[0].box1.dtype)
+        self.num_particles = self.coordinates.shape[1]
+        for i_replica, mcs in enumerate(self.states):
+            mcs.box1.coordinates = self.coordinates[i_replica]
+        self.beta = 1.0 / np.broadcast_to(np.asarray(reduced_temperature, dtype=float), (self.num_replicas,))
+        self.max_displacement = np.full(self.num_replicas, max_displacement, dtype=float)
+        self.tune_displacement = tune_displacement
+        self.freq = freq
+        self.sinks = [] if sinks is None else list(sinks)
+        self.rng = np.random.default_rng(rng)
+        self.batch_size = batch_size
+        self.random_uniforms = np.zeros((0, self.num_replicas, 5))
+        self.i_random = 0
+        self.n_trials = np.zeros(self.num_replicas, dtype=int)
+        self.n_accept = np.zeros(self.num_replicas, dtype=int)
+        self.n_steps_done = 0
+        self.replica_index = np.arange(self.num_replicas)
+        self.total_pair_energy = np.array([mcs.calculate_total_pair_energy() for mcs in self.states])
+        self.tail_correction = np.array([mcs.calculate_tail_correction() for mcs in self.states])
+        self.unit_energy = (self.total_pair_energy + self.tail_correction) / self.num_particles
+
+    def get_particle_energies(self, particles, positions):
+        """
+        Computes, in every replica at once, the energy of one particle placed at a given position.
+
+        Parameters
+        ----------
+        particles : np.array(num_replicas)
+            Particle whose energy is computed in each replica.
+        positions : np.array(num_replicas,3)
+            Position of that particle in each replica.
+
+        Returns
+        -------
+        e_total : np.array(num_replicas)
+            Energy of the particle in each replica.
+        """
+        rij = self.coordinates - positions[:, np.newaxis, :]
+        self.states[0].box1.minimum_image(rij, out=rij)
+        rij2 = np.einsum('rjk,rjk->rj', rij, rij)
+        rij2[self.replica_index, particles] = np.inf
+        within_cutoff = rij2 < self.cutoff2
+        e_pairs = np.zeros_like(rij2)
+        e_pairs[within_cutoff] = self.states[0].lennard_jones_potential(rij2[within_cutoff])
+        return np.sum(e_pairs, axis=1)
+
+    def step(self):
+        """
+        Performs one Metropolis trial move in every replica.
+
+        Returns
+        -------
+        unit_energy : np.array(num_replicas)
+            The total unit energy per particle of each replica after the step.
+        """
+        if self.i_random == len(self.random_uniforms):
+            self.random_uniforms = self.rng.random((self.batch_size, self.num_replicas, 5))
+            self.i_random = 0
+        uniforms = self.random_uniforms[self.i_random]
+        self.i_random += 1
+        particles = np.minimum((uniforms[:, 0] * self.num_particles).astype(int), self.num_particles - 1)
+        displacements = (2.0 * uniforms[:, 1:4] - 1.0) * self.max_displacement[:, np.newaxis]
+        current_positions = self.coordinates[self.replica_index, particles]
+        proposed_positions = current_positions + displacements
+        delta_e = (self.get_particle_energies(particles, proposed_positions)
+                   - self.get_particle_energies(particles, current_positions))
+        with np.errstate(over='ignore'):
+            accept = (delta_e < 0.0) | (uniforms[:, 4] < np.exp(-self.beta * delta_e))
+        self.coordinates[self.replica_index[accept], particles[accept]] = proposed_positions[accept]
+        self.total_pair_energy[accept] += delta_e[accept]
+        self.n_trials += 1
+        self.n_accept += accept
+        self.unit_energy = (self.total_pair_energy + self.tail_correction) / self.num_particles
+        self.n_steps_done += 1
+
+        if self.n_steps_done % self.freq == 0:
+            self.sync_states()
+            for sink in self.sinks:
+                sink(self)
+            if self.tune_displacement:
+                for i_replica in range(self.num_replicas):
+                    adjusted = adjust_displacement(self.n_trials[i_replica], self.n_accept[i_replica],
+                                                   self.max_displacement[i_replica])
+                    self.max_displacement[i_replica], self.n_trials[i_replica], self.n_accept[i_replica] = adjusted
+        return self.unit_energy
+
+    def sync_states(self):
+        """
+        Copies the running energies of each replica into its MCState and refreshes the spatial indices and energy
+        caches of the states, which are not maintained by the vectorized steps.
+        """
+        for i_replica, mcs in enumerate(self.states):
+            mcs.total_pair_energy = self.total_pair_energy[i_replica]
+            mcs.unit_energy = self.unit_energy[i_replica]
+            mcs.rebuild_indices()
+
+    def run(self, n_steps):
+        """
+        Performs n_steps Metropolis trial moves in every replica.
+
+        Parameters
+        ----------
+        n_steps : integer
+            Number of trial moves to perform in each replica.
+
+        Returns
+        -------
+        energy_array : np.array(n_steps,num_replicas)
+            The total unit energy per particle of each replica after each step.
+        """
+        energy_array = np.zeros((n_steps, self.num_replicas))
+        for i_step in range(n_steps):
+            energy_array[i_step] = self.step()
+        self.sync_states()
+        return energy_array
+
 if __name__ == "__main__":
 
     #------------------
@@ -326,50 +2240,25 @@ if __name__ == "__main__":
     tune_displacement = True
     build_method = 'random'
     num_particles=100
-
-    box_length = np.cbrt(num_particles / reduced_density)
-    beta = 1.0 / reduced_temperature
-    simulation_cutoff2 = np.power(simulation_cutoff, 2)
-    n_trials = 0
-    n_accept = 0
-    energy_array = np.zeros(n_steps)
+    seed = None
+    rng = np.random.default_rng(seed)
 
     #-----------------------
     # Monte Carlo Simulation
     #-----------------------
     if (build_method == 'random'):
-        coordinates = generate_initial_state(method = build_method, num_particles = num_particles, box_length = box_length)
+        box_length = np.cbrt(num_particles / reduced_density)
+        coordinates = generate_initial_state(method = build_method, num_particles = num_particles,
+                                             box_length = box_length, rng = rng)
     elif(build_method == 'file'):
         coordinates = generate_initial_state(method = build_method, file_name='sample_config1.xyz')
     num_particles = len(coordinates)
     box_length = np.cbrt(num_particles / reduced_density)
-    mcs=MCState(Box(box_length,coordinates),simulation_cutoff)
-    total_pair_energy = mcs.calculate_total_pair_energy()
-    tail_correction = mcs.calculate_tail_correction()
-
-    for i_step in range(n_steps):
-        n_trials += 1
-        i_particle = np.random.randint(num_particles)
-        random_displacement = (2.0 * np.random.rand(3) - 1.0) * max_displacement
-        current_energy = mcs.get_particle_energy(i_particle)
-        proposed_coordinates = coordinates.copy()
-        proposed_coordinates[i_particle] += random_displacement 
-        mcs_check=MCState(Box(box_length,proposed_coordinates),simulation_cutoff)
-        proposed_energy = mcs_check.get_particle_energy(i_particle)
-        delta_e = proposed_energy - current_energy
-        accept = accept_or_reject(delta_e, beta)
-        if accept:
-            mcs.total_pair_energy += delta_e
-            n_accept += 1
-            coordinates[i_particle] += random_displacement
-             
-        total_energy = mcs.calculate_unit_energy()
-        energy_array[i_step] = total_energy
-
-        if np.mod(i_step + 1, freq) == 0:
-            print(i_step + 1, energy_array[i_step])
-            if tune_displacement:
-                max_displacement, n_trials, n_accept = adjust_displacement(n_trials, n_accept, max_displacement)
+    mcs=MCState(Box(box_length,coordinates),simulation_cutoff,energy_cache=True)
+    simulation = Simulation(mcs, reduced_temperature, max_displacement=max_displacement,
+                            tune_displacement=tune_displacement, freq=freq, rng=rng,
+                            sinks=[print_progress, lambda simulation: simulation.mcs.check_energy_cache()])
+    energy_array = simulation.run(n_steps)
     #print(coordinates)
     #print(calculate_total_pair_energy(coordinates, 10.0, 9.0))
     #print(calculate_tail_correction(10.0, 3.0, len(coordinates)))
@@ -0,0 +1,616 @@
+"""
+parallel.py
+Drivers running Monte Carlo simulations of Lennard Jones particles across several processes.
+"""
+
+
+import argparse
+import concurrent.futures
+import hashlib
+import inspect
+import multiprocessing
+import os
+
+import numpy as np
+
+from .mc_lj_potential import Box, MCState, Simulation, accept_or_reject, generate_initial_state, spawn_generators
+
+__all__ = ['STATE_POINT_FIELDS', 'ParallelTempering', 'run_state_point', 'state_point_file', 'sweep_state_points',
+           'get_attached_state', 'parallel_total_pair_energy', 'get_domain_index', 'CheckerboardSimulation']
+
+STATE_POINT_FIELDS = [('reduced_temperature', float), ('reduced_density', float), ('mean_energy', float),
+                      ('energy_error', float)]
+
+def _tempering_worker(connection, simulations):
+    """
+    Event loop of a parallel tempering worker process, which owns a few replicas for the whole run.
+
+    Parameters
+    ----------
+    connection : multiprocessing.connection.Connection
+        Pipe to the parent process. Messages are ('run', n_steps, betas), ('get',) and ('stop',).
+    simulations : list of Simulation
+        Replicas owned by the worker.
+    """
+    while True:
+        message = connection.recv()
+        if message[0] == 'run':
+            n_steps, betas = message[1], message[2]
+            energies = []
+            for simulation, beta in zip(simulations, betas):
+                simulation.beta = beta
+                simulation.reduced_temperature = 1.0 / beta
+                simulation.run(n_steps)
+                energies.append(simulation.mcs.total_pair_energy + simulation.mcs.tail_correction)
+            connection.send(energies)
+        elif message[0] == 'get':
+            connection.send(simulations)
+        else:
+            connection.close()
+            return
+
+class ParallelTempering:
+    """
+    Replica exchange Monte Carlo driver running one MCState per temperature in a pool of worker processes.
+
+    The replicas stay in their worker for the whole run. Every exchange_frequency steps, the workers report the
+    energy of their replicas and swaps between neighboring temperatures are attempted. An accepted swap exchanges the
+    temperatures of the two replicas, so only a few floats go through the pipes and the coordinates never move.
+
+    Parameters
+    ----------
+    states : list of MCState
+        One state per temperature.
+    temperatures : list of float
+        Reduced temperatures of the ladder, in increasing order. States[i] starts at temperatures[i].
+    exchange_frequency : integer
+        Number of Monte Carlo steps performed by every replica between two rounds of swap attempts.
+    n_workers : integer. Default is None.
+        Number of worker processes. If None, all the cores of the node are used, up to one per replica.
+    seed : integer. Default is None.
+        Root seed from which independent streams are spawned for every replica and for the swaps.
+    **simulation_options
+        Additional keyword arguments passed to the Simulation of each replica.
+    """
+    def __init__(self, states, temperatures, exchange_frequency=1000, n_workers=None, seed=None, **simulation_options):
+        if len(states) != len(temperatures):
+            raise ValueError("One state per temperature is required")
+        self.temperatures = np.asarray(temperatures, dtype=float)
+        self.betas = 1.0 / self.temperatures
+        self.num_replicas = len(states)
+        self.exchange_frequency = exchange_frequency
+        generators = spawn_generators(seed, self.num_replicas + 1)
+        self.rng = generators[-1]
+        simulation_options.setdefault('sinks', [])
+        simulations = [Simulation(mcs, temperature, rng=rng, **simulation_options)
+                       for mcs, temperature, rng in zip(states, self.temperatures, generators)]
+        self.replica_temperature = np.arange(self.num_replicas)
+        self.energies = np.array([simulation.mcs.total_pair_energy + simulation.mcs.tail_correction
+                                  for simulation in simulations])
+        self.n_swap_attempts = np.zeros(self.num_replicas - 1, dtype=int)
+        self.n_swap_accepts = np.zeros(self.num_replicas - 1, dtype=int)
+        self.n_exchanges = 0
+
+        if n_workers is None:
+            n_workers = multiprocessing.cpu_count()
+        n_workers = max(1, min(n_workers, self.num_replicas))
+        self.worker_replicas = np.array_split(np.arange(self.num_replicas), n_workers)
+        self.connections = []
+        self.processes = []
+        for replicas in self.worker_replicas:
+            parent_connection, child_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_tempering_worker,
+                                              args=(child_connection, [simulations[i] for i in replicas]), daemon=True)
+            process.start()
+            child_connection.close()
+            self.connections.append(parent_connection)
+            self.processes.append(process)
+
+    def attempt_swaps(self):
+        """
+        Attempts swaps between neighboring temperatures, alternating between even and odd pairs of the ladder.
+        """
+        temperature_replica = np.argsort(self.replica_temperature)
+        for i_pair in range(self.n_exchanges % 2, self.num_replicas - 1, 2):
+            replica_i = temperature_replica[i_pair]
+            replica_j = temperature_replica[i_pair + 1]
+            delta = ((self.betas[i_pair] - self.betas[i_pair + 1])
+                     * (self.energies[replica_i] - self.energies[replica_j]))
+            self.n_swap_attempts[i_pair] += 1
+            if delta >= 0.0 or self.rng.random() < np.exp(delta):
+                self.n_swap_accepts[i_pair] += 1
+                self.replica_temperature[replica_i] = i_pair + 1
+                self.replica_temperature[replica_j] = i_pair
+        self.n_exchanges += 1
+
+    def run(self, n_exchanges):
+        """
+        Runs n_exchanges rounds of exchange_frequency Monte Carlo steps per replica followed by swap attempts.
+
+        Parameters
+        ----------
+        n_exchanges : integer
+            Number of rounds to perform.
+
+        Returns
+        -------
+        energy_array : np.array(n_exchanges,num_replicas)
+            Total energy at each temperature of the ladder after each round.
+        """
+        energy_array = np.zeros((n_exchanges, self.num_replicas))
+        for i_exchange in range(n_exchanges):
+            for connection, replicas in zip(self.connections, self.worker_replicas):
+                connection.send(('run', self.exchange_frequency, self.betas[self.replica_temperature[replicas]]))
+            for connection, replicas in zip(self.connections, self.worker_replicas):
+                self.energies[replicas] = connection.recv()
+            self.attempt_swaps()
+            energy_array[i_exchange, self.replica_temperature] = self.energies
+        return energy_array
+
+    @property
+    def swap_acceptance(self):
+        """ Property decorator function which calculates the swap acceptance ratio of each pair of neighboring
+        temperatures.
+
+        Returns
+        -------
+        swap_acceptance : np.array(num_replicas - 1)
+            Accepted over attempted swaps between temperatures[i] and temperatures[i + 1], NaN before any attempt.
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.n_swap_accepts / self.n_swap_attempts
+
+    def get_simulations(self):
+        """
+        Fetches the current replicas from the workers.
+
+        Returns
+        -------
+        simulations : list of Simulation
+            Copy of the simulation of each replica, in the order of the initial states. The temperature at which a
+            replica currently runs is temperatures[replica_temperature[i]].
+        """
+        simulations = [None] * self.num_replicas
+        for connection, replicas in zip(self.connections, self.worker_replicas):
+            connection.send(('get',))
+            for i_replica, simulation in zip(replicas, connection.recv()):
+                simulations[i_replica] = simulation
+        return simulations
+
+    def close(self):
+        """
+        Stops the worker processes.
+        """
+        for connection, process in zip(self.connections, self.processes):
+            if process.is_alive():
+                connection.send(('stop',))
+                process.join()
+            connection.close()
+        self.connections = []
+        self.processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def run_state_point(reduced_temperature, reduced_density, num_particles=100, n_steps=50000, n_equilibration=10000,
+                    cutoff=3.0, max_displacement=0.1, n_blocks=10, backend='auto', seed=None):
+    """
+    Runs a Monte Carlo simulation at one state point and summarizes its unit energy.
+
+    Parameters
+    ----------
+    reduced_temperature : float
+        Reduced temperature of the state point.
+    reduced_density : float
+        Reduced density of the state point.
+    num_particles : integer
+        Number of particles in the simulation box.
+    n_steps : integer
+        Number of production steps whose energies are averaged.
+    n_equilibration : integer
+        Number of steps performed, and discarded, before the production steps.
+    cutoff : float
+        Cutoff value for Lennard Jones potential.
+    max_displacement : float
+        Initial maximum displacement allowed for any step in the simulation.
+    n_blocks : integer
+        Number of blocks used to estimate the statistical error of the mean.
+    backend : string
+        Energy backend of the MCState.
+    seed : integer or np.random.SeedSequence. Default is None.
+        Seed of the random number generator.
+
+    Returns
+    -------
+    summary : tuple
+        Reduced temperature, reduced density, mean unit energy and its block-averaged standard error.
+    """
+    rng = np.random.default_rng(seed)
+    box_length = np.cbrt(num_particles / reduced_density)
+    coordinates = generate_initial_state(method='random', num_particles=num_particles, box_length=box_length, rng=rng)
+    mcs = MCState(Box(box_length, coordinates), cutoff, backend=backend)
+    simulation = Simulation(mcs, reduced_temperature, max_displacement=max_displacement, sinks=[], rng=rng)
+    simulation.run(n_equilibration)
+    simulation.tune_displacement = False
+    energy_array = simulation.run(n_steps)
+    block_means = np.array([np.mean(block) for block in np.array_split(energy_array, n_blocks)])
+    energy_error = np.std(block_means, ddof=1) / np.sqrt(n_blocks) if n_blocks > 1 else np.nan
+    return reduced_temperature, reduced_density, float(np.mean(energy_array)), float(energy_error)
+
+def state_point_file(cache_directory, reduced_temperature, reduced_density, seed=None, **options):
+    """
+    Builds the name of the file caching the summary of a state point.
+
+    The name holds a hash of the state point, of the root seed of the sweep and of every option of
+    run_state_point(), with the defaults filled in, so changing any of them points to a different file.
+
+    Parameters
+    ----------
+    cache_directory : string
+        Directory holding the summaries of the state points already run.
+    reduced_temperature : float
+        Reduced temperature of the state point.
+    reduced_density : float
+        Reduced density of the state point.
+    seed : integer. Default is None.
+        Root seed of the sweep.
+    **options
+        Keyword arguments passed to run_state_point().
+
+    Returns
+    -------
+    file_name : string
+        Path of the cache file of the state point.
+    """
+    parameters = inspect.signature(run_state_point).parameters
+    key = {name: parameter.default for name, parameter in parameters.items()
+           if parameter.default is not inspect.Parameter.empty and name != 'seed'}
+    key.update(options)
+    key.update(reduced_temperature=reduced_temperature, reduced_density=reduced_density, seed=seed)
+    digest = hashlib.sha1(repr(sorted(key.items())).encode()).hexdigest()[:16]
+    name = 'T%.6g_rho%.6g_%s.npy' % (reduced_temperature, reduced_density, digest)
+    return os.path.join(cache_directory, name)
+
+def sweep_state_points(temperatures, densities, n_workers=None, cache_directory=None, seed=None, **options):
+    """
+    Runs run_state_point() over a temperature x density grid in a pool of worker processes.
+
+    Each worker builds its own Box and MCState and returns only the summary of its state point. When a cache
+    directory is given, the summary of every state point is saved there and state points whose summary is already
+    on disk, for the same seed and options, are not run again.
+
+    Parameters
+    ----------
+    temperatures : list of float
+        Reduced temperatures of the grid.
+    densities : list of float
+        Reduced densities of the grid.
+    n_workers : integer. Default is None.
+        Number of worker processes. If None, all the cores of the node are used.
+    cache_directory : string. Default is None.
+        Directory holding the summaries of the state points already run.
+    seed : integer. Default is None.
+        Root seed from which an independent stream is derived for every state point of the grid. The stream of a
+        state point depends only on the root seed and on its temperature and density, not on the rest of the grid.
+    **options
+        Additional keyword arguments passed to run_state_point().
+
+    Returns
+    -------
+    table : np.array(len(temperatures)*len(densities))
+        Structured array with the fields reduced_temperature, reduced_density, mean_energy and energy_error, in
+        temperature-major order.
+    """
+    state_points = [(temperature, density) for temperature in temperatures for density in densities]
+    root = np.random.SeedSequence(seed)
+    seeds = []
+    for state_point in state_points:
+        point_key = tuple(int(np.float64(value).view(np.uint64)) for value in state_point)
+        seeds.append(np.random.SeedSequence(root.entropy, spawn_key=root.spawn_key + point_key))
+    table = np.zeros(len(state_points), dtype=STATE_POINT_FIELDS)
+    if cache_directory is not None:
+        os.makedirs(cache_directory, exist_ok=True)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = {}
+        for i_point, (temperature, density) in enumerate(state_points):
+            if cache_directory is not None:
+                file_name = state_point_file(cache_directory, temperature, density, seed=seed, **options)
+                if os.path.exists(file_name):
+                    table[i_point] = tuple(np.load(file_name))
+                    continue
+            futures[executor.submit(run_state_point, temperature, density, seed=seeds[i_point], **options)] = i_point
+        for future in concurrent.futures.as_completed(futures):
+            i_point = futures[future]
+            table[i_point] = future.result()
+            if cache_directory is not None:
+                file_name = state_point_file(cache_directory, *state_points[i_point], seed=seed, **options)
+                np.save(file_name, np.array(table[i_point].tolist()))
+    return table
+
+_attached_states = {}
+
+def get_attached_state(handle):
+    """
+    Returns the MCState of the current worker process attached to a shared state, attaching it on first use.
+
+    Parameters
+    ----------
+    handle : dict
+        Handle returned by MCState.share_memory().
+
+    Returns
+    -------
+    mcs : MCState
+        State whose coordinates are a zero-copy view of the shared coordinates.
+    """
+    name = handle['box']['coordinates'][0]
+    if name not in _attached_states:
+        _attached_states[name] = MCState.from_shared_memory(handle, backend='numpy')
+    return _attached_states[name]
+
+def _total_pair_energy_task(handle, first_row, last_row):
+    return get_attached_state(handle).calculate_total_pair_energy_numpy(first_row, last_row)
+
+def parallel_total_pair_energy(mcs, n_workers=None, executor=None):
+    """
+    Computes the total pair energy of a state by summing row tiles of the pair matrix in worker processes.
+
+    The coordinates are moved to shared memory, so the workers attach to them instead of receiving a pickled copy.
+    The tiles hold about the same number of pairs and their partial sums are added in a fixed order.
+
+    Parameters
+    ----------
+    mcs : MCState
+        State whose total pair energy is computed.
+    n_workers : integer. Default is None.
+        Number of worker processes and of tiles. If None, all the cores of the node are used.
+    executor : concurrent.futures.ProcessPoolExecutor. Default is None.
+        Pool reused across calls. If None, a pool is created for the call.
+
+    Returns
+    -------
+    e_total : float
+        Total energy of the system, also stored in mcs.total_pair_energy.
+    """
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count() if executor is None else executor._max_workers
+    handle = mcs.share_memory()
+    num_particles = mcs.box1.num_particles
+    boundaries = np.unique(np.round(num_particles * np.sqrt(np.linspace(0.0, 1.0, n_workers + 1))).astype(int))
+    tiles = list(zip(boundaries[:-1], boundaries[1:]))
+    if executor is None:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as pool:
+            partial_sums = list(pool.map(_total_pair_energy_task, [handle] * len(tiles), *zip(*tiles)))
+    else:
+        partial_sums = list(executor.map(_total_pair_energy_task, [handle] * len(tiles), *zip(*tiles)))
+    mcs.total_pair_energy = float(np.sum(partial_sums))
+    return mcs.total_pair_energy
+
+def get_domain_index(positions, box_length, domains_per_side, shift):
+    """
+    Computes the grid position of the domain containing each position, for a domain grid whose origin is shifted.
+
+    Parameters
+    ----------
+    positions : np.array(num_positions,3) or np.array(3)
+        Positions to locate.
+    box_length : float
+        Side of cubic simulation box.
+    domains_per_side : integer
+        Number of domains along each side of the box.
+    shift : np.array(3)
+        Origin of the domain grid.
+
+    Returns
+    -------
+    grid : np.array(num_positions,3) or np.array(3)
+        Integer grid position of the domain containing each position.
+    """
+    scaled = (positions - shift) / box_length
+    scaled = scaled - np.floor(scaled)
+    return (scaled * domains_per_side).astype(int) % domains_per_side
+
+def _checkerboard_task(handle, domains, domains_per_side, shift, n_moves, beta, max_displacement, seeds):
+    """
+    Performs n_moves trial moves in each of the given domains of the active sublattice.
+
+    Moves leaving their domain are rejected. The particles of the other active domains are farther than the
+    cutoff, so the domains can be updated concurrently in place in the shared coordinates.
+
+    Returns
+    -------
+    result : tuple
+        Number of trials, number of accepted moves and total pair energy change.
+    """
+    mcs = get_attached_state(handle)
+    coordinates = mcs.box1.coordinates
+    box_length = mcs.box1.box_length
+    cutoff2 = mcs.cutoff2
+    grid_shape = (domains_per_side,) * 3
+    particle_domain = np.ravel_multi_index(get_domain_index(coordinates, box_length, domains_per_side, shift).T,
+                                           grid_shape)
+    # Particles sorted by domain, so that the members of domain k are sorted_particles[starts[k]:starts[k + 1]].
+    sorted_particles = np.argsort(particle_domain, kind='stable')
+    starts = np.searchsorted(particle_domain[sorted_particles], np.arange(domains_per_side**3 + 1))
+    offsets = np.array([[dx, dy, dz] for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)])
+    n_trials = 0
+    n_accept = 0
+    delta_total = 0.0
+    for domain, seed in zip(domains, seeds):
+        rng = np.random.default_rng(seed)
+        i_domain = np.ravel_multi_index(domain, grid_shape)
+        members = sorted_particles[starts[i_domain]:starts[i_domain + 1]]
+        if len(members) == 0:
+            continue
+        neighbor_domains = np.unique(np.ravel_multi_index(((domain + offsets) % domains_per_side).T, grid_shape))
+        candidates = np.concatenate([sorted_particles[starts[j_domain]:starts[j_domain + 1]]
+                                     for j_domain in neighbor_domains])
+        uniforms = rng.random((n_moves, 5))
+        for i_move in range(n_moves):
+            n_trials += 1
+            i_particle = members[min(int(uniforms[i_move, 0] * len(members)), len(members) - 1)]
+            proposed_position = coordinates[i_particle] + (2.0 * uniforms[i_move, 1:4] - 1.0) * max_displacement
+            if np.any(get_domain_index(proposed_position, box_length, domains_per_side, shift) != domain):
+                continue
+            partners = candidates[candidates != i_particle]
+            energies = []
+            for position in (coordinates[i_particle], proposed_position):
+                rij = coordinates[partners] - position
+                mcs.box1.minimum_image(rij, out=rij)
+                rij2 = np.einsum('ij,ij->i', rij, rij)
+                energies.append(np.sum(mcs.lennard_jones_potential(rij2[rij2 < cutoff2])))
+            delta_e = energies[1] - energies[0]
+            if accept_or_reject(delta_e, beta, uniforms[i_move, 4]):
+                coordinates[i_particle] = proposed_position
+                n_accept += 1
+                delta_total += delta_e
+    return n_trials, n_accept, delta_total
+
+class CheckerboardSimulation:
+    """
+    Domain-decomposed Monte Carlo engine updating one large system on several cores.
+
+    The box is split into domains_per_side**3 cubic domains, with an even number of domains per side and domains at
+    least as wide as the cutoff. The domains are colored in eight sublattices by the parity of their grid position,
+    so two domains of the same sublattice are always separated by a full domain and their particles do not interact.
+    Each sweep picks a random sublattice and a random origin of the domain grid, and the worker processes perform
+    moves_per_domain trial moves in every domain of that sublattice concurrently, writing to coordinates held in
+    shared memory. Moves leaving their domain are rejected, which keeps the proposal symmetric, and the random
+    choices of sublattice and origin keep the sampling in detailed balance and ergodic.
+
+    Parameters
+    ----------
+    mcs : MCState
+        State of the system to simulate. Its box coordinates are moved to shared memory until close() is called.
+    reduced_temperature : float
+        Reduced temperature of the canonical ensemble.
+    max_displacement : float
+        Maximum displacement allowed for any step in the simulation.
+    moves_per_domain : integer
+        Number of trial moves performed in every active domain during one sweep.
+    n_workers : integer. Default is None.
+        Number of worker processes. If None, all the cores of the node are used.
+    seed : integer. Default is None.
+        Seed of the random number generator choosing the sublattices, the grid origins and the moves.
+    """
+    def __init__(self, mcs, reduced_temperature, max_displacement=0.1, moves_per_domain=10, n_workers=None, seed=None):
+        box_length = mcs.box1.box_length
+        if np.ndim(box_length) != 0:
+            raise ValueError("The checkerboard decomposition requires a cubic box")
+        self.domains_per_side = int(box_length // mcs.cutoff)
+        self.domains_per_side -= self.domains_per_side % 2
+        if self.domains_per_side < 2:
+            raise ValueError("The box must be at least twice as wide as the cutoff for a checkerboard decomposition")
+        self.mcs = mcs
+        self.beta = 1.0 / reduced_temperature
+        self.max_displacement = max_displacement
+        self.moves_per_domain = moves_per_domain
+        self.n_workers = multiprocessing.cpu_count() if n_workers is None else n_workers
+        self.rng = np.random.default_rng(seed)
+        self.n_trials = 0
+        self.n_accept = 0
+
+        self.handle = {'box': mcs.box1.share_memory(), 'cutoff': mcs.cutoff, 'block_size': mcs.block_size,
+                       'lj_table': mcs.lj_table}
+        mcs.rebuild_indices()
+        mcs.calculate_total_pair_energy()
+        mcs.calculate_tail_correction()
+        mcs.calculate_unit_energy()
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.n_workers)
+
+    def sweep(self):
+        """
+        Performs moves_per_domain trial moves in every domain of a randomly chosen sublattice.
+
+        Returns
+        -------
+        unit_energy : float
+            The total unit energy per particle after the sweep.
+        """
+        sublattice = self.rng.integers(2, size=3)
+        shift = self.rng.random(3) * self.mcs.box1.box_length / self.domains_per_side
+        grid = np.arange(self.domains_per_side // 2) * 2
+        domains = np.array([[ix, iy, iz] for ix in grid for iy in grid for iz in grid]) + sublattice
+        seeds = self.rng.integers(2**63, size=len(domains))
+        chunks = np.array_split(np.arange(len(domains)), min(self.n_workers, len(domains)))
+        futures = [self.executor.submit(_checkerboard_task, self.handle, domains[chunk], self.domains_per_side, shift,
+                                        self.moves_per_domain, self.beta, self.max_displacement, seeds[chunk])
+                   for chunk in chunks]
+        for future in futures:
+            n_trials, n_accept, delta_e = future.result()
+            self.n_trials += n_trials
+            self.n_accept += n_accept
+            self.mcs.total_pair_energy += delta_e
+        return self.mcs.calculate_unit_energy()
+
+    def run(self, n_sweeps):
+        """
+        Performs n_sweeps sweeps.
+
+        Parameters
+        ----------
+        n_sweeps : integer
+            Number of sweeps to perform.
+
+        Returns
+        -------
+        energy_array : np.array(n_sweeps)
+            The total unit energy per particle after each sweep.
+        """
+        energy_array = np.zeros(n_sweeps)
+        for i_sweep in range(n_sweeps):
+            energy_array[i_sweep] = self.sweep()
+        return energy_array
+
+    def close(self):
+        """
+        Stops the worker processes, copies the coordinates back into private memory and releases the shared block.
+        """
+        if self.handle is None:
+            return
+        self.executor.shutdown()
+        self.mcs.box1.release_shared_memory()
+        self.mcs.rebuild_indices()
+        self.handle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def main(argv=None):
+    """
+    Command line interface of sweep_state_points(), installed as the mc-lj-sweep command, printing the table of the
+    grid and optionally saving it.
+    """
+    parser = argparse.ArgumentParser(description="Monte Carlo simulations of Lennard Jones particles over a "
+                                                 "temperature x density grid.")
+    parser.add_argument('--temperatures', type=float, nargs='+', required=True,
+                        help="Reduced temperatures of the grid.")
+    parser.add_argument('--densities', type=float, nargs='+', required=True, help="Reduced densities of the grid.")
+    parser.add_argument('--num-particles', type=int, default=100)
+    parser.add_argument('--n-steps', type=int, default=50000)
+    parser.add_argument('--n-equilibration', type=int, default=10000)
+    parser.add_argument('--cutoff', type=float, default=3.0)
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes, all cores by default.")
+    parser.add_argument('--cache-directory', default=None, help="Directory caching the summary of each state point.")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', default=None, help="Text file receiving the table.")
+    args = parser.parse_args(argv)
+
+    table = sweep_state_points(args.temperatures, args.densities, n_workers=args.workers,
+                               cache_directory=args.cache_directory, seed=args.seed,
+                               num_particles=args.num_particles, n_steps=args.n_steps,
+                               n_equilibration=args.n_equilibration, cutoff=args.cutoff)
+    header = ' '.join(name for name, dtype in STATE_POINT_FIELDS)
+    print(header)
+    for row in table:
+        print(' '.join('%.6f' % value for value in row))
+    if args.output is not None:
+        np.savetxt(args.output, np.array(table.tolist()), header=header)
+    return table
@@ -70,18 +70,20 @@ def test_lennard_jones_potential():
     calculated_value = mcs.lennard_jones_potential(0.5)
     assert np.isclose(expected_vaule, calculated_value)
 
-@pytest.fixture
-def mcs():
+@pytest.fixture(params=['numpy', 'numba'])
+def mcs(request):
     """
-    Set up the fixture to have a general MCState that can be callable for all tests of different energy functions.
+    Set up the fixture to have a general MCState that can be callable for all tests of different energy functions, once for each of the numpy and numba backends.
     """ 
+    if request.param == 'numba' and not mc_lj_potential.NUMBA_AVAILABLE:
+        pytest.skip("numba is not installed")
     current_directory = os.path.dirname(os.path.abspath(__file__))
     file_path = os.path.join(current_directory, "sample_config.xyz")
     coordinates = mc_lj_potential.generate_initial_state(method = "file", file_name=file_path)
     box_length = 10.0
     cutoff = 3.0
     box = mc_lj_potential.Box(box_length=box_length, coordinates=coordinates)
-    mcs = mc_lj_potential.MCState(box, cutoff = cutoff)
+    mcs = mc_lj_potential.MCState(box, cutoff = cutoff, backend = request.param)
     return mcs
 
 def test_calculate_total_pair_energy(mcs):
@@ -197,7 +199,9 @@ def test_wrap_1():
     box_length = 3.0
     mcs = mc_lj_potential.Box(coordinates = coordinates, box_length = box_length)
     expected_coordinates = [1, -1, 1]
-    mcs.wrap(coordinates = coordinates, box_length = box_length)
+    wrapped = mcs.wrap(coordinates = coordinates, box_length = box_length)
+    assert np.array_equal(expected_coordinates, wrapped)
+    mcs.wrap()
     assert np.array_equal(expected_coordinates, mcs.coordinates)
 
 def test_wrap_2():
@@ -217,7 +221,9 @@ def test_wrap_2():
     box_length = 6.0
     mcs = mc_lj_potential.Box(coordinates = coordinates, box_length = box_length)
     expected_coordinates = [1, 0, 1.5]
-    mcs.wrap(coordinates = coordinates, box_length = box_length)
+    wrapped = mcs.wrap(coordinates = coordinates, box_length = box_length)
+    assert np.array_equal(expected_coordinates, wrapped)
+    mcs.wrap()
     assert np.array_equal(expected_coordinates, mcs.coordinates)
 
 def test_minimum_image_distance_1():
@@ -266,6 +272,34 @@ def test_minimum_image_distance_2():
     calculated_distance=mcs.minimum_image_distance(r_i = r_a, r_j = r_b, box_length = box_length)
     assert np.isclose(expected_distance, calculated_distance)
     
+def test_minimum_image_distance_batches():
+    """
+    Test that minimum_image_distance handles (M, 3) batches of pairs and all positions against one reference, matching the pairwise results.
+    """
+    positions = np.random.RandomState(1).uniform(-6, 6, (20, 3))
+    box = mc_lj_potential.Box(box_length = 5.0, coordinates = positions)
+    pairwise = [box.minimum_image_distance(positions[i], positions[i - 1]) for i in range(20)]
+    assert np.allclose(box.minimum_image_distance(positions, np.roll(positions, 1, axis = 0)), pairwise)
+    one_to_all = [box.minimum_image_distance(positions[3], position) for position in positions]
+    assert np.allclose(box.minimum_image_distance(positions[3], positions), one_to_all)
+    rij = positions - positions[3]
+    assert box.minimum_image(rij, out = rij) is rij
+    assert np.allclose(np.einsum('ij,ij->i', rij, rij), one_to_all)
+    assert np.all(np.abs(rij) <= 2.5)
+
+def test_wrap_rows_in_place():
+    """
+    Test that wrap only wraps the selected rows, in place.
+    """
+    coordinates = np.array([[4.0, -4.0, 0.5], [6.0, 1.0, -3.0], [1.0, 2.0, 3.0]])
+    box = mc_lj_potential.Box(box_length = 5.0, coordinates = coordinates)
+    box_coordinates = box.coordinates
+    assert box.wrap(indices = [0, 1]) is box_coordinates
+    assert np.array_equal(box.coordinates, [[-1.0, 1.0, 0.5], [1.0, 1.0, 2.0], [1.0, 2.0, 3.0]])
+    other = np.array([[7.0, 0.0, 0.0]])
+    assert box.wrap(other) is other and np.array_equal(other, [[2.0, 0.0, 0.0]])
+    assert np.array_equal(box.wrap(other, box_length = 1.5), [[0.5, 0.0, 0.0]])
+
 def test_volume_1():
     """Test the result of the volume function[property]- State 1
     Parameters
@@ -303,3 +337,467 @@ def test_volume_2():
     expected_volume = 1728
     calculated_volume = mcs.volume
     assert expected_volume == calculated_volume
+
+def test_calculate_total_pair_energy_numpy_matches_python(mcs):
+    """
+    Test the blocked numpy total pair energy against the reference python double loop, using a block size small enough to force several row blocks.
+    """
+    python_mcs = mc_lj_potential.MCState(mcs.box1, cutoff = mcs.cutoff, backend = 'python')
+    numpy_mcs = mc_lj_potential.MCState(mcs.box1, cutoff = mcs.cutoff, backend = 'numpy', block_size = 5000)
+    assert np.isclose(python_mcs.calculate_total_pair_energy(), numpy_mcs.calculate_total_pair_energy())
+
+def test_mcstate_unknown_backend():
+    """
+    Test that an unknown energy backend is rejected.
+    """
+    box = mc_lj_potential.Box(box_length = 10.0, coordinates = np.zeros((2, 3)))
+    with pytest.raises(ValueError):
+        mc_lj_potential.MCState(box, cutoff = 3.0, backend = 'fortran')
+
+def test_get_particle_energy_numpy_matches_python(mcs):
+    """
+    Test the vectorized get_particle_energy() against the python loop, both for a stored particle and for a trial position.
+    """
+    python_mcs = mc_lj_potential.MCState(mcs.box1, cutoff = mcs.cutoff, backend = 'python')
+    trial_position = mcs.box1.coordinates[7] + np.array([0.05, -0.1, 0.02])
+    assert np.isclose(python_mcs.get_particle_energy(7), mcs.get_particle_energy(7))
+    assert np.isclose(python_mcs.get_particle_energy(7, trial_position), mcs.get_particle_energy(7, trial_position))
+
+def test_get_particle_energy_trial_position():
+    """
+    Test that a trial position is evaluated without modifying the stored coordinates.
+    """
+    coordinates = np.array([[0.0, 0.0, 0.0], [0.0, 0.0, 4.0]])
+    box = mc_lj_potential.Box(box_length = 10.0, coordinates = coordinates)
+    mcs = mc_lj_potential.MCState(box, cutoff = 3.0)
+    calculated_value = mcs.get_particle_energy(0, np.array([0.0, 0.0, 3.0]))
+    assert np.isclose(calculated_value, 0.0)
+    assert np.array_equal(coordinates[0], [0.0, 0.0, 0.0])
+
+def test_cell_backend_matches_numpy(mcs):
+    """
+    Test the cell-list total and particle energies against the all-pairs numpy backend.
+    """
+    box = mc_lj_potential.Box(box_length = mcs.box1.box_length, coordinates = mcs.box1.coordinates.copy())
+    cell_mcs = mc_lj_potential.MCState(box, cutoff = mcs.cutoff, backend = 'cell')
+    assert box.cells_per_side == (3, 3, 3)
+    assert np.isclose(cell_mcs.calculate_total_pair_energy(), mcs.calculate_total_pair_energy())
+    assert np.isclose(cell_mcs.get_particle_energy(0), mcs.get_particle_energy(0))
+
+def test_cell_backend_rebuilds_narrow_cell_list(mcs):
+    """
+    Test that the cell backend rebuilds a cell list whose cells are narrower than the cutoff.
+    """
+    coordinates = mcs.box1.coordinates.copy()
+    box = mc_lj_potential.Box(box_length = mcs.box1.box_length, coordinates = coordinates, cell_width = 1.0)
+    assert box.cells_per_side == (10, 10, 10)
+    cell_mcs = mc_lj_potential.MCState(box, cutoff = mcs.cutoff, backend = 'cell')
+    assert box.cells_per_side == (3, 3, 3)
+    assert np.isclose(cell_mcs.calculate_total_pair_energy(), mcs.calculate_total_pair_energy())
+
+def test_cell_list_move_particle():
+    """
+    Test that moving a particle across a cell boundary updates the cell list, including across the periodic boundary.
+    """
+    coordinates = np.array([[0.5, 0.5, 0.5], [4.5, 0.5, 0.5]])
+    box = mc_lj_potential.Box(box_length = 10.0, coordinates = coordinates, cell_width = 3.0)
+    mcs = mc_lj_potential.MCState(box, cutoff = 3.0, backend = 'cell')
+    assert np.isclose(mcs.get_particle_energy(0), 0.0)
+    box.move_particle(1, np.array([-7.5, 0.5, 0.5]))
+    assert 1 in box.cell_members[box.particle_cell[1]]
+    assert box.particle_cell[1] == box.get_cell_index(np.array([2.5, 0.5, 0.5]))
+    assert np.isclose(mcs.get_particle_energy(0), mcs.lennard_jones_potential(4.0))
+
+def test_verlet_backend_matches_numpy(mcs):
+    """
+    Test the Verlet neighbor-list energies against the numpy backend, before and after a series of moves.
+    """
+    box = mc_lj_potential.Box(box_length = mcs.box1.box_length, coordinates = mcs.box1.coordinates.copy())
+    verlet_mcs = mc_lj_potential.MCState(box, cutoff = mcs.cutoff, backend = 'verlet', skin = 0.3)
+    numpy_mcs = mc_lj_potential.MCState(box, cutoff = mcs.cutoff)
+    assert verlet_mcs.n_rebuilds == 1
+    assert verlet_mcs.average_neighbors > 0
+    assert np.isclose(verlet_mcs.calculate_total_pair_energy(), numpy_mcs.calculate_total_pair_energy())
+    for step in range(20):
+        verlet_mcs.move_particle(3, box.coordinates[3] + np.array([0.05, 0.0, 0.0]))
+    assert verlet_mcs.n_rebuilds > 1
+    trial_position = box.coordinates[3] + np.array([0.0, 0.4, 0.0])
+    assert np.isclose(verlet_mcs.get_particle_energy(3, trial_position), numpy_mcs.get_particle_energy(3, trial_position))
+    assert np.isclose(verlet_mcs.calculate_total_pair_energy(), numpy_mcs.calculate_total_pair_energy())
+
+@pytest.mark.parametrize("backend", ['numpy', 'cell', 'verlet'])
+def test_energy_cache_updates_on_move(mcs, backend):
+    """
+    Test that the per-particle energy cache stays consistent with a full recompute after accepted moves.
+    """
+    box = mc_lj_potential.Box(box_length = mcs.box1.box_length, coordinates = mcs.box1.coordinates.copy())
+    cached_mcs = mc_lj_potential.MCState(box, cutoff = mcs.cutoff, backend = backend, energy_cache = True)
+    assert np.isclose(np.sum(cached_mcs.particle_energies), 2.0 * mcs.calculate_total_pair_energy())
+    assert np.isclose(cached_mcs.get_particle_energy(0), -10.877945)
+    for i_particle in [0, 5, 17, 5]:
+        cached_mcs.move_particle(i_particle, box.coordinates[i_particle] + np.array([0.1, -0.05, 0.12]))
+    assert cached_mcs.check_energy_cache() < 1e-8
+    assert np.isclose(cached_mcs.get_particle_energy(5), cached_mcs.get_particle_energy(5, box.coordinates[5]))
+
+def test_energy_cache_reports_drift(mcs):
+    """
+    Test that the consistency check warns when the cache no longer matches the coordinates.
+    """
+    mcs.build_energy_cache()
+    mcs.box1.coordinates[0] += 0.2
+    with pytest.warns(RuntimeWarning):
+        drift = mcs.check_energy_cache()
+    assert drift > 0.0
+
+@pytest.mark.parametrize("energy_cache", [False, True])
+def test_trial_move_accept_and_reject(mcs, energy_cache):
+    """
+    Test the propose/evaluate/accept/reject trial move API: a rejected move leaves the coordinates untouched and an accepted move updates only the moved row and the total pair energy.
+    """
+    if energy_cache:
+        mcs.build_energy_cache()
+    total_pair_energy = mcs.calculate_total_pair_energy()
+    coordinates = mcs.box1.coordinates
+    original_coordinates = coordinates.copy()
+    displacement = np.array([0.1, 0.0, -0.1])
+
+    mcs.propose_move(4, displacement)
+    delta_e = mcs.evaluate_move()
+    mcs.reject_move()
+    assert np.array_equal(coordinates, original_coordinates)
+
+    mcs.propose_move(4, displacement)
+    assert np.isclose(mcs.evaluate_move(), delta_e)
+    mcs.accept_move()
+    assert mcs.box1.coordinates is coordinates
+    assert np.allclose(coordinates[4], original_coordinates[4] + displacement)
+    assert np.array_equal(np.delete(coordinates, 4, axis=0), np.delete(original_coordinates, 4, axis=0))
+    assert np.isclose(mcs.total_pair_energy, total_pair_energy + delta_e)
+    assert np.isclose(mcs.total_pair_energy, mcs.calculate_total_pair_energy())
+
+def test_simulation_run(mcs):
+    """
+    Test the Simulation engine: the running total pair energy matches a full recompute and the sinks are called every freq steps.
+    """
+    reports = []
+    simulation = mc_lj_potential.Simulation(mcs, reduced_temperature = 0.9, freq = 50, seed = 42, sinks = [lambda simulation: reports.append(simulation.n_steps_done)])
+    energy_array = simulation.run(200)
+    assert len(energy_array) == 200
+    assert reports == [50, 100, 150, 200]
+    assert np.isclose(mcs.total_pair_energy, mcs.calculate_total_pair_energy())
+    assert np.isclose(energy_array[-1], mcs.calculate_unit_energy())
+
+def test_mcstate_auto_backend():
+    """
+    Test that the 'auto' backend selects numba when it is importable and numpy otherwise, and that the backend can be switched at runtime.
+    """
+    box = mc_lj_potential.Box(box_length = 10.0, coordinates = np.array([[0.0, 0.0, 0.0], [0.0, 0.0, 1.5]]))
+    mcs = mc_lj_potential.MCState(box, cutoff = 3.0)
+    assert mcs.backend == ('numba' if mc_lj_potential.NUMBA_AVAILABLE else 'numpy')
+    energy = mcs.get_particle_energy(0)
+    mcs.set_backend('numpy')
+    assert mcs.backend == 'numpy'
+    assert np.isclose(mcs.get_particle_energy(0), energy)
+
+def test_simulation_reproducible_across_batch_sizes(mcs):
+    """
+    Test that the buffered random numbers make a run depend only on the seed, not on the batch size.
+    """
+    coordinates = mcs.box1.coordinates.copy()
+    energy_arrays = []
+    for batch_size in [7, 4096]:
+        box = mc_lj_potential.Box(box_length = mcs.box1.box_length, coordinates = coordinates.copy())
+        state = mc_lj_potential.MCState(box, cutoff = mcs.cutoff, backend = mcs.backend)
+        simulation = mc_lj_potential.Simulation(state, reduced_temperature = 0.9, freq = 50, seed = 2019, batch_size = batch_size, sinks = [])
+        energy_arrays.append(simulation.run(100))
+    assert np.array_equal(energy_arrays[0], energy_arrays[1])
+
+def test_accept_or_reject_given_random_number():
+    """
+    Test the accept_or_reject function with a supplied uniform random number.
+    """
+    assert mc_lj_potential.accept_or_reject(1.0, 1.0, random_number = 0.3)
+    assert not mc_lj_potential.accept_or_reject(1.0, 1.0, random_number = 0.4)
+
+def test_generate_initial_state_rng():
+    """
+    Test that generate_initial_state() is reproducible from an explicit generator or seed and does not touch the global random state.
+    """
+    np.random.seed(123)
+    coordinates_1 = mc_lj_potential.generate_initial_state("random", num_particles = 10, box_length = 10.0, rng = 7)
+    coordinates_2 = mc_lj_potential.generate_initial_state("random", num_particles = 10, box_length = 10.0, rng = np.random.default_rng(7))
+    try:
+        assert np.array_equal(coordinates_1, coordinates_2)
+        assert np.isclose(np.random.rand(), 0.69646919)
+    finally:
+        np.random.seed()
+
+def test_spawn_generators():
+    """
+    Test that spawned streams are reproducible from the root seed and differ from each other.
+    """
+    streams_1 = mc_lj_potential.spawn_generators(2019, 3)
+    streams_2 = mc_lj_potential.spawn_generators(2019, 4)
+    draws_1 = [stream.random(5) for stream in streams_1]
+    draws_2 = [stream.random(5) for stream in streams_2]
+    for i_stream in range(3):
+        assert np.array_equal(draws_1[i_stream], draws_2[i_stream])
+    assert not np.array_equal(draws_1[0], draws_1[1])
+    assert mc_lj_potential.accept_or_reject(1.0, 1.0, rng = np.random.default_rng(0)) == (np.random.default_rng(0).random() < np.exp(-1.0))
+    with pytest.raises(TypeError):
+        mc_lj_potential.accept_or_reject(1.0, 1.0, rng = 0)
+
+def test_replica_simulation(mcs):
+    """
+    Test the replica-batched engine: every replica keeps its running total pair energy consistent with a full recompute of its own MCState.
+    """
+    states = []
+    for i_replica in range(3):
+        box = mc_lj_potential.Box(box_length = mcs.box1.box_length, coordinates = mcs.box1.coordinates.copy())
+        states.append(mc_lj_potential.MCState(box, cutoff = mcs.cutoff, backend = mcs.backend))
+    simulation = mc_lj_potential.ReplicaSimulation(states, reduced_temperature = [0.9, 1.2, 2.0], freq = 50, rng = 3)
+    energy_array = simulation.run(100)
+    assert energy_array.shape == (100, 3)
+    assert states[0].box1.coordinates.base is simulation.coordinates
+    assert not np.array_equal(simulation.coordinates[0], simulation.coordinates[1])
+    for i_replica, state in enumerate(states):
+        assert np.isclose(state.total_pair_energy, state.calculate_total_pair_energy())
+        assert np.isclose(energy_array[-1, i_replica], state.calculate_unit_energy())
+
+def test_replica_simulation_lj_table(mcs):
+    """
+    Test that the replica-batched engine refuses replicas whose Lennard Jones tables differ.
+    """
+    states = []
+    for lj_table in [None, mc_lj_potential.LennardJonesTable(mcs.cutoff, n_points = 64)]:
+        box = mc_lj_potential.Box(box_length = mcs.box1.box_length, coordinates = mcs.box1.coordinates.copy())
+        states.append(mc_lj_potential.MCState(box, cutoff = mcs.cutoff, backend = 'numpy', lj_table = lj_table))
+    with pytest.raises(ValueError):
+        mc_lj_potential.ReplicaSimulation(states, reduced_temperature = 0.9)
+
+def test_calculate_total_pair_energy_threads(mcs):
+    """
+    Test that the thread-parallel total pair energy is bit-identical to the serial one whatever the number of threads.
+    """
+    mcs.block_size = 8000
+    serial_energy = mcs.calculate_total_pair_energy()
+    for n_threads in [2, 3]:
+        mcs.n_threads = n_threads
+        assert mcs.calculate_total_pair_energy() == serial_energy
+    assert np.isclose(serial_energy, -4.3515E+03)
+
+@pytest.mark.parametrize("backend,energy_cache", [('numpy', True), ('numba', False), ('cell', True), ('verlet', True)])
+def test_checkpoint_resume_bit_exact(mcs, tmpdir, backend, energy_cache):
+    """
+    Test that a run interrupted by a checkpoint and resumed is bit-identical to an uninterrupted run.
+    """
+    if backend == 'numba' and not mc_lj_potential.NUMBA_AVAILABLE:
+        pytest.skip("numba is not installed")
+    checkpoint_file = str(tmpdir.join('checkpoint.npz'))
+    coordinates = mcs.box1.coordinates.copy()
+    options = dict(reduced_temperature = 0.9, freq = 40, seed = 17, batch_size = 64, sinks = [])
+
+    box = mc_lj_potential.Box(box_length = 10.0, coordinates = coordinates.copy())
+    reference = mc_lj_potential.Simulation(mc_lj_potential.MCState(box, cutoff = 3.0, backend = backend, energy_cache = energy_cache), **options)
+    reference_energies = reference.run(200)
+
+    box = mc_lj_potential.Box(box_length = 10.0, coordinates = coordinates.copy())
+    simulation = mc_lj_potential.Simulation(mc_lj_potential.MCState(box, cutoff = 3.0, backend = backend, energy_cache = energy_cache), checkpoint_file = checkpoint_file, checkpoint_frequency = 90, **options)
+    simulation.run(100)
+    resumed = mc_lj_potential.resume(checkpoint_file, sinks = [])
+    assert resumed.n_steps_done == 90
+    resumed_energies = resumed.run(110)
+    assert np.array_equal(resumed_energies, reference_energies[90:])
+    assert np.array_equal(resumed.box.coordinates, reference.box.coordinates)
+    assert resumed.max_displacement == reference.max_displacement
+    if energy_cache:
+        assert np.array_equal(resumed.mcs.particle_energies, reference.mcs.particle_energies)
+
+def test_checkpoint_on_termination_request(mcs, tmpdir):
+    """
+    Test that a termination request, as sent by the SIGTERM handler, writes a checkpoint after the current step and raises SimulationTerminated.
+    """
+    checkpoint_file = str(tmpdir.join('checkpoint.npz'))
+    sinks = [lambda simulation: simulation.request_termination()]
+    simulation = mc_lj_potential.Simulation(mcs, reduced_temperature = 0.9, freq = 25, seed = 3, sinks = sinks, checkpoint_file = checkpoint_file)
+    with pytest.raises(mc_lj_potential.SimulationTerminated) as terminated:
+        simulation.run(100)
+    assert terminated.value.checkpoint_file == checkpoint_file
+    assert len(terminated.value.energy_array) == 25
+    resumed = mc_lj_potential.resume(checkpoint_file, sinks = [])
+    assert resumed.n_steps_done == 25
+    assert resumed.mcs.total_pair_energy == mcs.total_pair_energy
+
+@pytest.mark.parametrize("method, n_points, tolerance", [('linear', 2**16, 2e-5), ('cubic', 4096, 1e-7)])
+def test_lennard_jones_table(method, n_points, tolerance):
+    """
+    Test that the tabulated Lennard Jones potential reports its maximum error and stays within it, also below r_min.
+    """
+    table = mc_lj_potential.LennardJonesTable(3.0, n_points = n_points, method = method)
+    assert table.max_error < tolerance
+    rij2 = np.random.RandomState(0).uniform(0.5, 9.0, 10000)
+    analytic = 4.0 * (rij2**-6 - rij2**-3)
+    assert np.max(np.abs(table(rij2) - analytic)) <= table.max_error
+    assert table(0.5) == 4.0 * (0.5**-6 - 0.5**-3)
+
+@pytest.mark.parametrize("backend", ['python', 'numpy', 'numba', 'cell', 'verlet'])
+def test_lennard_jones_table_backends(mcs, backend):
+    """
+    Test that every energy backend uses the tabulated potential and agrees with the analytic energies.
+    """
+    if backend == 'numba' and not mc_lj_potential.NUMBA_AVAILABLE:
+        pytest.skip("numba is not installed")
+    table = mc_lj_potential.LennardJonesTable(mcs.cutoff, method = 'linear', n_points = 1024)
+    expected_total = mcs.calculate_total_pair_energy()
+    expected_particle = mcs.get_particle_energy(0)
+    tabulated = mc_lj_potential.MCState(mcs.box1, mcs.cutoff, backend = backend, lj_table = table)
+    total = tabulated.calculate_total_pair_energy()
+    assert total != expected_total
+    assert np.isclose(total, expected_total, rtol = 1e-3)
+    assert np.isclose(tabulated.get_particle_energy(0), expected_particle, rtol = 1e-3)
+    with pytest.raises(ValueError):
+        mc_lj_potential.MCState(mcs.box1, 4.0, backend = backend, lj_table = table)
+
+def test_read_xyz_frames(tmpdir):
+    """
+    Test that read_xyz_frames reads every frame of a multi-frame XYZ file and the box length from its comment line.
+    """
+    sample_path = os.path.join(os.path.dirname(__file__), '..', 'sample_config1.xyz')
+    expected = np.loadtxt(sample_path, skiprows = 2, usecols = (1, 2, 3))
+    file_name = str(tmpdir.join('frames.xyz'))
+    with open(sample_path) as handle:
+        text = handle.read()
+    with open(file_name, 'w') as handle:
+        handle.write(text + '\n' + text.replace('Ar', 'Kr'))
+    frames = list(mc_lj_potential.read_xyz_frames(file_name))
+    assert len(frames) == 2
+    for coordinates, box_length in frames:
+        assert np.array_equal(coordinates, expected)
+        assert box_length == 10.0
+    coordinates = mc_lj_potential.generate_initial_state(method = 'file', file_name = sample_path)
+    assert np.array_equal(coordinates, expected)
+
+def test_parse_box_length():
+    """
+    Test parsing of the box length from XYZ comment lines.
+    """
+    assert mc_lj_potential.parse_box_length(' 8.0 ') == 8.0
+    assert np.array_equal(mc_lj_potential.parse_box_length('8.0 9.0 10.0'), [8.0, 9.0, 10.0])
+    assert mc_lj_potential.parse_box_length('8 0 0 0 8 0 0 0 8') == 8.0
+    assert np.array_equal(mc_lj_potential.parse_box_length('8 0 0 2 9 0 0 0 10'), [[8, 0, 0], [2, 9, 0], [0, 0, 10]])
+    assert mc_lj_potential.parse_box_length('') is None
+    assert mc_lj_potential.parse_box_length('generated by hand') is None
+
+def test_cached_constants():
+    """
+    Test that the derived constants cached on Box and MCState follow changes of the box length, coordinates and cutoff.
+    """
+    box = mc_lj_potential.Box(2.0, np.zeros((4, 3)))
+    mcs = mc_lj_potential.MCState(box, cutoff = 1.0, backend = 'numpy')
+    assert box.inverse_box_length == 0.5 and box.volume == 8.0 and box.num_particles == 4
+    assert mcs.cutoff2 == 1.0
+    box.box_length = 4.0
+    box.coordinates = np.zeros((8, 3))
+    mcs.cutoff = 2.0
+    assert box.inverse_box_length == 0.25 and box.volume == 64.0 and box.num_particles == 8
+    assert mcs.cutoff2 == 4.0
+    assert np.isclose(mcs.calculate_tail_correction(), (8.0 / 9.0) * np.pi * 64 / 64.0 * (2.0**-9 - 3.0 * 2.0**-3))
+
+@pytest.mark.parametrize("backend", ['cell', 'verlet'])
+def test_setters_rebuild_indices(backend):
+    """
+    Test that replacing the box length, the coordinates or the cutoff keeps the cell list, the Verlet list and the
+    energy cache in step with the new geometry.
+    """
+    coordinates = mc_lj_potential.generate_initial_state("random", num_particles = 300, box_length = 10.0, rng = 5)
+    mcs = mc_lj_potential.MCState(mc_lj_potential.Box(10.0, coordinates), 3.0, backend = backend, energy_cache = True)
+    def reference():
+        return mc_lj_potential.MCState(mc_lj_potential.Box(mcs.box1.box_length, mcs.box1.coordinates), mcs.cutoff, backend = 'numpy')
+    mcs.box1.box_length = 7.0
+    assert np.isclose(mcs.calculate_total_pair_energy(), reference().calculate_total_pair_energy())
+    assert np.allclose(mcs.calculate_particle_energies(), reference().calculate_particle_energies())
+    mcs.cutoff = 3.4
+    assert np.isclose(mcs.calculate_total_pair_energy(), reference().calculate_total_pair_energy())
+    assert np.isclose(mcs.get_particle_energy(7), reference().get_particle_energy(7))
+    mcs.box1.coordinates = coordinates[:200]
+    assert np.isclose(mcs.calculate_total_pair_energy(), reference().calculate_total_pair_energy())
+    assert np.isclose(mcs.get_particle_energy(199), reference().get_particle_energy(199))
+    mcs.set_lj_table(mc_lj_potential.LennardJonesTable(3.5, n_points = 64))
+    with pytest.raises(ValueError):
+        mcs.cutoff = 4.0
+
+@pytest.mark.parametrize("backend", ['python', 'numpy', 'numba', 'cell', 'verlet'])
+def test_float32_coordinates(backend):
+    """
+    Test that a float32 box stores contiguous float32 coordinates and that every backend accumulates its energies in float64.
+    """
+    if backend == 'numba' and not mc_lj_potential.NUMBA_AVAILABLE:
+        pytest.skip("numba is not installed")
+    box_length = np.cbrt(150 / 0.8)
+    coordinates = mc_lj_potential.generate_initial_state("random", num_particles = 150, box_length = box_length, rng = 3)
+    reference = mc_lj_potential.MCState(mc_lj_potential.Box(box_length, coordinates.astype(np.float32)), 3.0, backend = 'numpy')
+    box = mc_lj_potential.Box(box_length, np.asfortranarray(coordinates), dtype = np.float32)
+    assert box.coordinates.dtype == np.float32 and box.coordinates.flags['C_CONTIGUOUS']
+    single = mc_lj_potential.MCState(box, 3.0, backend = backend, energy_cache = True)
+    total = single.calculate_total_pair_energy()
+    assert isinstance(total, float)
+    assert np.isclose(total, reference.calculate_total_pair_energy(), rtol = 1e-5)
+    assert np.isclose(single.get_particle_energy(0, coordinates[0] + 0.1), reference.get_particle_energy(0, coordinates[0] + 0.1), rtol = 1e-5)
+    simulation = mc_lj_potential.Simulation(single, reduced_temperature = 0.9, seed = 0, sinks = [])
+    simulation.run(50)
+    assert box.coordinates.dtype == np.float32
+    assert np.isclose(single.particle_energies.sum() / 2, single.calculate_total_pair_energy())
+
+def test_slots_pickle():
+    """
+    Test that Box and MCState reject unknown attributes and survive pickling.
+    """
+    import pickle
+    box = mc_lj_potential.Box(5.0, np.zeros((2, 3)), dtype = np.float32)
+    mcs = mc_lj_potential.MCState(box, 2.0, backend = 'numpy')
+    with pytest.raises(AttributeError):
+        box.box_size = 5.0
+    with pytest.raises(AttributeError):
+        mcs.cut_off = 2.0
+    copy = pickle.loads(pickle.dumps(mcs))
+    assert copy.box1.coordinates.dtype == np.float32 and copy.box1.volume == 125.0 and copy.cutoff2 == 4.0
+
+@pytest.mark.parametrize("box_length", [[9.0, 7.5, 12.0], [[9.0, 0.0, 0.0], [1.5, 8.0, 0.0], [-1.0, 2.0, 10.0]]])
+def test_noncubic_box(box_length):
+    """
+    Test the minimum image, volume, tail correction and cell list of orthorhombic and triclinic boxes, and that all energy backends agree on them.
+    """
+    cell = np.diag(box_length) if np.ndim(box_length) == 1 else np.array(box_length)
+    coordinates = mc_lj_potential.generate_initial_state("random", num_particles = 120, box_length = box_length, rng = 5)
+    box = mc_lj_potential.Box(box_length, coordinates)
+    assert np.isclose(box.volume, abs(np.linalg.det(cell)))
+    images = np.array([[i, j, k] for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)]) @ cell
+    rij = coordinates[1:] - coordinates[0]
+    brute_force = np.min(np.sum((rij[:, np.newaxis, :] + images[np.newaxis, :, :])**2, axis = 2), axis = 1)
+    short = brute_force < (0.5 * np.min(box.widths))**2
+    assert np.allclose(box.minimum_image_distance(coordinates[0], coordinates[1:])[short], brute_force[short])
+
+    reference = mc_lj_potential.MCState(box, 3.0, backend = 'python')
+    expected_total = reference.calculate_total_pair_energy()
+    assert np.isclose(reference.calculate_tail_correction(), (8.0 / 9.0) * np.pi * 120**2 / box.volume * (3.0**-9 - 3.0 * 3.0**-3))
+    backends = ['numpy', 'cell', 'verlet']
+    if box.orthorhombic and mc_lj_potential.NUMBA_AVAILABLE:
+        backends.append('numba')
+    for backend in backends:
+        mcs = mc_lj_potential.MCState(mc_lj_potential.Box(box_length, coordinates), 3.0, backend = backend)
+        assert np.isclose(mcs.calculate_total_pair_energy(), expected_total)
+        assert np.isclose(mcs.get_particle_energy(7, coordinates[7] + 0.2), reference.get_particle_energy(7, coordinates[7] + 0.2))
+    box.build_cell_list(3.0)
+    assert box.cells_per_side == tuple(int(width // 3.0) for width in box.widths)
+
+def test_triclinic_box_backend():
+    """
+    Test that triclinic boxes select the numpy backend automatically and reject the numba backend.
+    """
+    box = mc_lj_potential.Box([[8.0, 0.0, 0.0], [2.0, 8.0, 0.0], [0.0, 0.0, 8.0]], np.zeros((2, 3)))
+    assert not box.orthorhombic
+    assert mc_lj_potential.MCState(box, 3.0).backend == 'numpy'
+    if mc_lj_potential.NUMBA_AVAILABLE:
+        with pytest.raises(ValueError):
+            mc_lj_potential.MCState(box, 3.0, backend = 'numba')
+    assert mc_lj_potential.Box([[5.0, 0, 0], [0, 5.0, 0], [0, 0, 5.0]]).orthorhombic
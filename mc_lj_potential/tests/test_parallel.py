@@ -0,0 +1,156 @@
+"""
+Unit and regression test for the parallel drivers of the mc_lj_potential package.
+"""
+# Import package, test suite, and other packages as needed
+import mc_lj_potential
+import pytest
+import numpy as np
+
+def make_state(num_particles, reduced_density, seed, backend = 'numpy'):
+    """
+    Build a random MCState with the given number of particles and reduced density.
+    """
+    box_length = np.cbrt(num_particles / reduced_density)
+    coordinates = mc_lj_potential.generate_initial_state("random", num_particles = num_particles, box_length = box_length, rng = seed)
+    return mc_lj_potential.MCState(mc_lj_potential.Box(box_length, coordinates), cutoff = 3.0, backend = backend)
+
+def test_parallel_tempering():
+    """
+    Test the replica exchange driver: swaps are attempted between every pair of neighboring temperatures, and each replica keeps a running energy consistent with its coordinates.
+    """
+    temperatures = [0.8, 1.0, 1.3]
+    states = [make_state(30, 0.5, seed) for seed in range(3)]
+    with mc_lj_potential.ParallelTempering(states, temperatures, exchange_frequency = 20, n_workers = 2, seed = 5) as tempering:
+        energy_array = tempering.run(10)
+        simulations = tempering.get_simulations()
+    assert energy_array.shape == (10, 3)
+    assert np.all(tempering.n_swap_attempts == 5)
+    assert np.all((tempering.swap_acceptance >= 0.0) & (tempering.swap_acceptance <= 1.0))
+    assert sorted(tempering.replica_temperature) == [0, 1, 2]
+    for i_replica, simulation in enumerate(simulations):
+        assert np.isclose(simulation.beta, 1.0 / temperatures[tempering.replica_temperature[i_replica]])
+        assert np.isclose(simulation.mcs.total_pair_energy, simulation.mcs.calculate_total_pair_energy())
+
+def test_sweep_state_points(tmpdir):
+    """
+    Test the state point sweep: one row per grid point, and cached state points are read back instead of being run again.
+    """
+    options = dict(num_particles = 20, n_steps = 200, n_equilibration = 100, n_blocks = 4, backend = 'numpy')
+    table = mc_lj_potential.sweep_state_points([0.9, 2.0], [0.1, 0.3], n_workers = 2, cache_directory = str(tmpdir), seed = 11, **options)
+    assert len(table) == 4
+    assert np.array_equal(table['reduced_temperature'], [0.9, 0.9, 2.0, 2.0])
+    assert np.array_equal(table['reduced_density'], [0.1, 0.3, 0.1, 0.3])
+    assert np.all(np.isfinite(table['mean_energy']))
+    assert len(tmpdir.listdir()) == 4
+    cached_table = mc_lj_potential.sweep_state_points([0.9, 2.0], [0.1, 0.3], n_workers = 2, cache_directory = str(tmpdir), seed = 11, **options)
+    assert np.array_equal(cached_table, table)
+
+def test_sweep_cache_options(tmpdir):
+    """
+    Test that a state point is run again when the cutoff or the seed of the sweep changes.
+    """
+    options = dict(num_particles = 20, n_steps = 100, n_equilibration = 50, n_blocks = 4, backend = 'numpy')
+    table = mc_lj_potential.sweep_state_points([0.9], [0.3], n_workers = 1, cache_directory = str(tmpdir), seed = 11, **options)
+    assert len(tmpdir.listdir()) == 1
+    short_table = mc_lj_potential.sweep_state_points([0.9], [0.3], n_workers = 1, cache_directory = str(tmpdir), seed = 11, cutoff = 1.5, **options)
+    assert len(tmpdir.listdir()) == 2
+    assert short_table['mean_energy'][0] != table['mean_energy'][0]
+    mc_lj_potential.sweep_state_points([0.9], [0.3], n_workers = 1, cache_directory = str(tmpdir), seed = 12, **options)
+    assert len(tmpdir.listdir()) == 3
+
+def test_sweep_seed_independent_of_grid(tmpdir):
+    """
+    Test that a state point gives the same result in any grid, so the cache matches a fresh run of a reordered grid.
+    """
+    options = dict(num_particles = 20, n_steps = 100, n_equilibration = 50, n_blocks = 4, backend = 'numpy')
+    cache_directory = str(tmpdir)
+    grid_table = mc_lj_potential.sweep_state_points([0.9, 1.5], [0.3], n_workers = 1, cache_directory = cache_directory,
+                                                    seed = 5, **options)
+    alone_table = mc_lj_potential.sweep_state_points([1.5], [0.3], n_workers = 1, seed = 5, **options)
+    assert np.array_equal(alone_table[0], grid_table[1])
+    reordered_table = mc_lj_potential.sweep_state_points([1.5, 0.9], [0.3], n_workers = 1, seed = 5, **options)
+    cached_table = mc_lj_potential.sweep_state_points([1.5, 0.9], [0.3], n_workers = 1, cache_directory = cache_directory,
+                                                      seed = 5, **options)
+    assert np.array_equal(cached_table, reordered_table)
+
+def test_sweep_command_line(tmpdir):
+    """
+    Test the command line interface of the state point sweep.
+    """
+    output = str(tmpdir.join('table.txt'))
+    mc_lj_potential.parallel.main(['--temperatures', '1.5', '--densities', '0.2', '--num-particles', '10',
+                                   '--n-steps', '50', '--n-equilibration', '10', '--workers', '1', '--output', output])
+    assert np.loadtxt(output).shape == (4,)
+
+def test_checkerboard_simulation():
+    """
+    Test the checkerboard engine: the running total pair energy stays consistent with the coordinates, and the coordinates are returned to private memory on close.
+    """
+    mcs = make_state(200, 0.5, 4)
+    with mc_lj_potential.CheckerboardSimulation(mcs, reduced_temperature = 1.5, moves_per_domain = 20, n_workers = 2, seed = 8) as simulation:
+        assert simulation.domains_per_side == 2
+        energy_array = simulation.run(5)
+        assert np.isclose(mcs.total_pair_energy, mcs.calculate_total_pair_energy())
+    assert simulation.n_trials == 5 * 20
+    assert 0 < simulation.n_accept <= simulation.n_trials
+    assert simulation.handle is None
+    assert mcs.box1.shared_handle is None
+    assert isinstance(mcs.box1.coordinates, np.ndarray)
+    assert np.isclose(energy_array[-1], mcs.calculate_unit_energy())
+
+def test_checkerboard_simulation_concurrent_domains():
+    """
+    Test the checkerboard engine with several active domains per sweep updated concurrently by the workers.
+    """
+    mcs = make_state(900, 0.5, 6)
+    with mc_lj_potential.CheckerboardSimulation(mcs, reduced_temperature = 1.5, moves_per_domain = 10, n_workers = 2,
+                                                seed = 9) as simulation:
+        assert simulation.domains_per_side == 4
+        energy_array = simulation.run(3)
+        assert np.isclose(mcs.total_pair_energy, mcs.calculate_total_pair_energy())
+    assert simulation.n_trials == 3 * 8 * 10
+    assert 0 < simulation.n_accept <= simulation.n_trials
+    assert np.isclose(energy_array[-1], mcs.calculate_unit_energy())
+
+def test_share_memory_round_trip():
+    """
+    Test that a state attached to shared memory sees the coordinates and neighbor arrays of the original state without copying them, and that releasing restores private arrays.
+    """
+    mcs = make_state(50, 0.5, 1, backend = 'verlet')
+    handle = mcs.share_memory()
+    attached = mc_lj_potential.MCState.from_shared_memory(handle)
+    mcs.box1.coordinates[0] += 0.01
+    assert np.array_equal(attached.box1.coordinates, mcs.box1.coordinates)
+    assert np.array_equal(attached.neighbor_indices, mcs.neighbor_indices)
+    assert np.isclose(attached.calculate_total_pair_energy(), mcs.calculate_total_pair_energy())
+    mcs.release_shared_memory()
+    assert mcs.box1.shared_handle is None
+    assert mcs.shared_handles == []
+    mcs.box1.coordinates[0] += 0.01
+    assert not np.array_equal(attached.box1.coordinates, mcs.box1.coordinates)
+
+def test_parallel_total_pair_energy():
+    """
+    Test the process-parallel total pair energy against the serial numpy result.
+    """
+    mcs = make_state(300, 0.8, 2)
+    expected = mcs.calculate_total_pair_energy()
+    try:
+        assert np.isclose(mc_lj_potential.parallel_total_pair_energy(mcs, n_workers = 3), expected)
+    finally:
+        mcs.release_shared_memory()
+
+def test_parallel_total_pair_energy_new_coordinates():
+    """
+    Test that replacing the coordinates of a shared box shares the new coordinates with the workers.
+    """
+    mcs = make_state(300, 0.8, 2)
+    try:
+        mc_lj_potential.parallel_total_pair_energy(mcs, n_workers = 2)
+        mcs.box1.coordinates = make_state(300, 0.8, 5).box1.coordinates
+        assert mcs.box1.shared_handle is not None
+        expected = mc_lj_potential.MCState(mc_lj_potential.Box(mcs.box1.box_length, mcs.box1.coordinates), mcs.cutoff,
+                                           backend = 'numpy').calculate_total_pair_energy()
+        assert np.isclose(mc_lj_potential.parallel_total_pair_energy(mcs, n_workers = 2), expected)
+    finally:
+        mcs.release_shared_memory()
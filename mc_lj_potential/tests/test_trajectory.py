@@ -0,0 +1,112 @@
+"""
+Unit and regression test for the trajectory input and output of the mc_lj_potential package.
+"""
+# Import package, test suite, and other packages as needed
+import mc_lj_potential
+import pytest
+import numpy as np
+import os
+
+@pytest.fixture
+def simulation():
+    """
+    Set up a small Simulation to record.
+    """
+    box_length = np.cbrt(30 / 0.5)
+    coordinates = mc_lj_potential.generate_initial_state("random", num_particles = 30, box_length = box_length, rng = 1)
+    mcs = mc_lj_potential.MCState(mc_lj_potential.Box(box_length, coordinates), cutoff = 3.0, backend = 'numpy')
+    return mc_lj_potential.Simulation(mcs, reduced_temperature = 0.9, seed = 2, sinks = [])
+
+@pytest.mark.parametrize("background", [False, True])
+def test_trajectory_writer_binary(simulation, tmpdir, background):
+    """
+    Test the binary trajectory writer: one frame every frequency steps, float32 storage, and the last frame equal to the final coordinates.
+    """
+    file_name = str(tmpdir.join('trajectory.bin'))
+    with mc_lj_potential.TrajectoryWriter(file_name, 30, frequency = 10, dtype = np.float32, buffer_frames = 3, background = background) as writer:
+        simulation.writers.append(writer)
+        simulation.run(100)
+    frames = np.fromfile(file_name, dtype = mc_lj_potential.frame_dtype(30, np.float32), offset = mc_lj_potential.HEADER_SIZE)
+    assert os.path.getsize(file_name) == mc_lj_potential.HEADER_SIZE + 10 * (88 + 30 * 3 * 4)
+    assert np.array_equal(frames['step'], np.arange(10, 101, 10))
+    assert np.array_equal(frames['coordinates'][-1], simulation.box.coordinates.astype(np.float32))
+    assert np.isclose(frames['energy'][-1], simulation.mcs.unit_energy)
+
+def test_trajectory_writer_background_error(tmpdir):
+    """
+    Test that an error raised by the background writing thread is re-raised by flush() and close() instead of blocking them.
+    """
+    writer = mc_lj_potential.TrajectoryWriter(str(tmpdir.join('trajectory.bin')), 4, buffer_frames = 2, background = True)
+    writer.handle.close()
+    with pytest.raises(ValueError):
+        for i_frame in range(6):
+            writer.write_frame(np.zeros((4, 3)))
+    writer.write_frame(np.zeros((4, 3)))
+    with pytest.raises(ValueError):
+        writer.close()
+    assert writer.handle is None and writer.thread is None
+
+def test_trajectory_writer_xyz(simulation, tmpdir):
+    """
+    Test that the XYZ trajectory writer produces frames readable by generate_initial_state(method='file').
+    """
+    file_name = str(tmpdir.join('trajectory.xyz'))
+    with mc_lj_potential.TrajectoryWriter(file_name, 30, file_format = 'xyz', frequency = 50) as writer:
+        simulation.writers.append(writer)
+        simulation.run(50)
+    coordinates = mc_lj_potential.generate_initial_state(method = 'file', file_name = file_name)
+    assert np.allclose(coordinates, simulation.box.coordinates)
+
+def test_trajectory_reader(tmpdir):
+    """
+    Test that the trajectory reader returns memory-mapped views of the written frames, supports slicing and iteration, and ignores a partially written frame.
+    """
+    file_name = str(tmpdir.join('trajectory.bin'))
+    frames = np.random.RandomState(0).random_sample((20, 5, 3))
+    with mc_lj_potential.TrajectoryWriter(file_name, 5, frequency = 1, dtype = np.float32, buffer_frames = 7) as writer:
+        for i_frame, coordinates in enumerate(frames):
+            writer.write_frame(coordinates, step = i_frame, box_length = 2.0, energy = -i_frame)
+    with open(file_name, 'ab') as handle:
+        handle.write(b'\0' * 10)
+
+    with mc_lj_potential.TrajectoryReader(file_name) as trajectory:
+        assert len(trajectory) == 20
+        assert trajectory[3].shape == (5, 3)
+        assert np.array_equal(trajectory[3], frames[3].astype(np.float32))
+        assert np.array_equal(trajectory[2:15:4], frames[2:15:4].astype(np.float32))
+        assert np.shares_memory(trajectory[2:15:4], trajectory.frames)
+        assert np.array_equal(trajectory.steps, np.arange(20))
+        assert np.array_equal(trajectory.energies, -np.arange(20))
+        assert np.array_equal(trajectory.cells[4], np.eye(3) * 2.0)
+        assert np.array_equal(trajectory.box_lengths[4], [2.0, 2.0, 2.0])
+        assert sum(1 for frame in trajectory) == 20
+
+def test_triclinic_trajectory(tmpdir):
+    """
+    Test that binary and XYZ trajectories keep the full cell matrix of a triclinic box.
+    """
+    cell = np.array([[6.0, 0.0, 0.0], [2.0, 6.0, 0.0], [1.0, 1.0, 6.0]])
+    coordinates = mc_lj_potential.generate_initial_state("random", num_particles = 20, box_length = cell, rng = 4)
+    mcs = mc_lj_potential.MCState(mc_lj_potential.Box(cell, coordinates), cutoff = 2.5, backend = 'numpy')
+    simulation = mc_lj_potential.Simulation(mcs, reduced_temperature = 0.9, seed = 2, sinks = [])
+    binary_name = str(tmpdir.join('trajectory.bin'))
+    xyz_name = str(tmpdir.join('trajectory.xyz'))
+    with mc_lj_potential.TrajectoryWriter(binary_name, 20, frequency = 10) as binary_writer, \
+         mc_lj_potential.TrajectoryWriter(xyz_name, 20, file_format = 'xyz', frequency = 10) as xyz_writer:
+        simulation.writers.extend([binary_writer, xyz_writer])
+        simulation.run(20)
+    with mc_lj_potential.TrajectoryReader(binary_name) as trajectory:
+        assert np.array_equal(trajectory.cells[-1], cell)
+    coordinates, box_length = list(mc_lj_potential.read_xyz_frames(xyz_name))[-1]
+    assert np.allclose(box_length, cell)
+    assert np.allclose(coordinates, simulation.box.coordinates)
+
+def test_trajectory_reader_invalid(tmpdir):
+    """
+    Test that the trajectory reader rejects files without the trajectory header.
+    """
+    file_name = str(tmpdir.join('trajectory.xyz'))
+    with open(file_name, 'w') as handle:
+        handle.write('1\n\n1 0.0 0.0 0.0\n')
+    with pytest.raises(ValueError):
+        mc_lj_potential.TrajectoryReader(file_name)
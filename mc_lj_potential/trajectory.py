@@ -0,0 +1,304 @@
+"""
+trajectory.py
+Trajectory output for Monte Carlo simulations of Lennard Jones particles.
+
+The binary trajectory format starts with a 64 byte header made of the magic string b'MCLJTRJ1', the number of
+particles (int64), the coordinate dtype as an 8 byte string ('<f4' or '<f8') and zero padding. It is followed by
+fixed-size frames, each made of the step (int64), the 3x3 cell matrix of the box (float64) whose rows are the edge
+vectors of the box, the unit energy (float64) and the (num_particles, 3) coordinates in the coordinate dtype.
+"""
+
+
+import queue
+import threading
+
+import numpy as np
+
+__all__ = ['TRAJECTORY_MAGIC', 'HEADER_SIZE', 'frame_dtype', 'TrajectoryWriter', 'TrajectoryReader']
+
+TRAJECTORY_MAGIC = b'MCLJTRJ1'
+HEADER_SIZE = 64
+
+def frame_dtype(num_particles, coordinate_dtype):
+    """
+    Builds the structured dtype of one frame of a binary trajectory.
+
+    Parameters
+    ----------
+    num_particles : integer
+        Number of particles in each frame.
+    coordinate_dtype : np.dtype
+        Storage dtype of the coordinates, float32 or float64.
+
+    Returns
+    -------
+    dtype : np.dtype
+        Structured dtype with the fields step, box_length, energy and coordinates.
+    """
+    return np.dtype([('step', '<i8'), ('box_length', '<f8', (3, 3)), ('energy', '<f8'),
+                     ('coordinates', np.dtype(coordinate_dtype).newbyteorder('<'), (num_particles, 3))])
+
+class TrajectoryWriter:
+    """
+    Streaming trajectory sink writing every frequency-th step of a Simulation.
+
+    Frames are copied into a buffer of buffer_frames frames, which is written in one go when full. With
+    background=True, full buffers are written by a separate thread while the simulation keeps running on a second
+    buffer, so the Metropolis loop only waits for the disk when both buffers are in flight. An error raised while
+    the background thread writes is re-raised by the next call to flush() or close().
+
+    Parameters
+    ----------
+    file_name : string
+        Trajectory file, overwritten if it exists.
+    num_particles : integer
+        Number of particles in each frame.
+    file_format : string. Either 'xyz' or 'binary'.
+        'xyz' writes concatenated XYZ frames in the layout read by generate_initial_state(method='file'), with the nine
+        entries of the cell matrix, row by row, on the comment line. 'binary' writes the binary trajectory format
+        described in this module.
+    frequency : integer
+        Number of simulation steps between two frames.
+    dtype : np.dtype
+        Storage dtype of the coordinates. np.float32 halves the size of binary trajectories.
+    buffer_frames : integer
+        Number of frames held in memory before they are written.
+    background : boolean
+        If true, buffers are written by a background thread.
+    """
+    def __init__(self, file_name, num_particles, file_format='binary', frequency=1000, dtype=np.float64,
+                 buffer_frames=64, background=False):
+        if file_format not in ('xyz', 'binary'):
+            raise ValueError("file_format must be either 'xyz' or 'binary', got %r" % (file_format,))
+        self.file_name = file_name
+        self.num_particles = num_particles
+        self.file_format = file_format
+        self.frequency = frequency
+        self.dtype = frame_dtype(num_particles, dtype)
+        self.buffer_frames = buffer_frames
+        self.n_frames = 0
+        self.handle = open(file_name, 'wb')
+        if file_format == 'binary':
+            header = np.zeros(HEADER_SIZE, dtype=np.uint8)
+            header[:8] = np.frombuffer(TRAJECTORY_MAGIC, dtype=np.uint8)
+            header[8:16] = np.frombuffer(np.int64(num_particles).tobytes(), dtype=np.uint8)
+            header[16:24] = np.frombuffer(self.dtype['coordinates'].base.str.encode().ljust(8, b'\0'), dtype=np.uint8)
+            self.handle.write(header.tobytes())
+        self.xyz_comment = b'%d\n' + b' '.join([b'%24.12E'] * 9) + b'\n'
+        self.xyz_line = '%5d %24.12E %24.12E %24.12E\n' * num_particles
+        self.xyz_index = np.arange(1, num_particles + 1)
+
+        self.free_buffers = queue.Queue()
+        for i_buffer in range(2 if background else 1):
+            self.free_buffers.put(np.zeros(buffer_frames, dtype=self.dtype))
+        self.buffer = self.free_buffers.get()
+        self.i_buffer = 0
+        self.full_buffers = None
+        self.thread = None
+        self.error = None
+        if background:
+            self.full_buffers = queue.Queue()
+            self.thread = threading.Thread(target=self.write_loop, daemon=True)
+            self.thread.start()
+
+    def __call__(self, simulation):
+        """
+        Records the current frame of a Simulation.
+
+        Parameters
+        ----------
+        simulation : Simulation
+            Simulation being recorded.
+        """
+        self.write_frame(simulation.box.coordinates, simulation.n_steps_done, simulation.box.cell,
+                         simulation.mcs.unit_energy)
+
+    def write_frame(self, coordinates, step=0, box_length=0.0, energy=0.0):
+        """
+        Adds one frame to the trajectory.
+
+        Parameters
+        ----------
+        coordinates : np.array(num_particles,3)
+            A numpy array with the x, y and z coordinates of each atom in the simulation box.
+        step : integer
+            Simulation step of the frame.
+        box_length : float, np.array(3) or np.array(3,3)
+            Side of cubic simulation box, three edge lengths of an orthorhombic box, or cell matrix of a triclinic box.
+        energy : float
+            Unit energy of the frame.
+        """
+        frame = self.buffer[self.i_buffer]
+        frame['step'] = step
+        box_length = np.asarray(box_length, dtype=float)
+        frame['box_length'] = box_length if box_length.ndim == 2 else np.eye(3) * box_length
+        frame['energy'] = energy
+        frame['coordinates'] = coordinates
+        self.i_buffer += 1
+        self.n_frames += 1
+        if self.i_buffer == self.buffer_frames:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered frames, or hands them to the background thread.
+        """
+        if self.i_buffer == 0:
+            return
+        if self.thread is None:
+            self.write_buffer(self.buffer, self.i_buffer)
+        else:
+            self.full_buffers.put((self.buffer, self.i_buffer))
+            self.buffer = self.free_buffers.get()
+        self.i_buffer = 0
+        self.raise_error()
+
+    def raise_error(self):
+        """
+        Re-raises, in the calling thread, the error raised by the background thread while writing, if any.
+        """
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def write_buffer(self, buffer, n_frames):
+        """
+        Writes the first n_frames frames of a buffer to the file.
+        """
+        if self.file_format == 'binary':
+            self.handle.write(buffer[:n_frames].tobytes())
+            return
+        for frame in buffer[:n_frames]:
+            self.handle.write(self.xyz_comment % ((self.num_particles,) + tuple(frame['box_length'].ravel())))
+            rows = np.column_stack([self.xyz_index, frame['coordinates']])
+            self.handle.write((self.xyz_line % tuple(rows.ravel().tolist())).encode())
+
+    def write_loop(self):
+        """
+        Background thread writing the buffers handed over by flush() until it receives None.
+
+        An error raised while writing is stored in error for flush() and close() to re-raise, and the buffer is
+        handed back in any case, so the simulation never waits for a buffer the thread will not return.
+        """
+        while True:
+            item = self.full_buffers.get()
+            if item is None:
+                return
+            buffer, n_frames = item
+            try:
+                self.write_buffer(buffer, n_frames)
+            except Exception as error:
+                self.error = error
+            finally:
+                self.free_buffers.put(buffer)
+
+    def close(self):
+        """
+        Writes the remaining frames, stops the background thread and closes the file.
+        """
+        if self.handle is None:
+            return
+        try:
+            self.flush()
+        finally:
+            if self.thread is not None:
+                self.full_buffers.put(None)
+                self.thread.join()
+                self.thread = None
+            self.handle.close()
+            self.handle = None
+        self.raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class TrajectoryReader:
+    """
+    Random-access reader of binary trajectories.
+
+    The file is memory-mapped, so frames are only read from disk when they are used. Indexing with an integer returns
+    the (num_particles, 3) coordinates of one frame, and indexing with a slice returns a (n_frames, num_particles, 3)
+    array; both are views into the mapped file, not copies. A partially written last frame is ignored.
+
+    Parameters
+    ----------
+    file_name : string
+        Binary trajectory written by TrajectoryWriter.
+    """
+    def __init__(self, file_name):
+        self.file_name = file_name
+        with open(file_name, 'rb') as handle:
+            header = handle.read(HEADER_SIZE)
+            handle.seek(0, 2)
+            file_size = handle.tell()
+        if len(header) < HEADER_SIZE or header[:8] != TRAJECTORY_MAGIC:
+            raise ValueError("%s is not a binary trajectory" % (file_name,))
+        self.num_particles = int(np.frombuffer(header[8:16], dtype='<i8')[0])
+        self.dtype = frame_dtype(self.num_particles, np.dtype(header[16:24].rstrip(b'\0').decode()))
+        self.n_frames = (file_size - HEADER_SIZE) // self.dtype.itemsize
+        if self.n_frames == 0:
+            self.frames = np.zeros(0, dtype=self.dtype)
+        else:
+            self.frames = np.memmap(file_name, dtype=self.dtype, mode='r', offset=HEADER_SIZE, shape=(self.n_frames,))
+
+    @property
+    def coordinates(self):
+        """
+        Property decorator function which returns the (n_frames, num_particles, 3) coordinates of all frames.
+        """
+        return self.frames['coordinates']
+
+    @property
+    def steps(self):
+        """
+        Property decorator function which returns the simulation step of each frame.
+        """
+        return self.frames['step']
+
+    @property
+    def cells(self):
+        """
+        Property decorator function which returns the (n_frames, 3, 3) cell matrices of the box in each frame.
+        """
+        return self.frames['box_length']
+
+    @property
+    def box_lengths(self):
+        """
+        Property decorator function which returns the three edge lengths of the box in each frame.
+        """
+        return np.linalg.norm(self.cells, axis=2)
+
+    @property
+    def energies(self):
+        """
+        Property decorator function which returns the unit energy of each frame.
+        """
+        return self.frames['energy']
+
+    def __len__(self):
+        return self.n_frames
+
+    def __getitem__(self, index):
+        return self.coordinates[index]
+
+    def __iter__(self):
+        coordinates = self.coordinates
+        for i_frame in range(self.n_frames):
+            yield coordinates[i_frame]
+
+    def close(self):
+        """
+        Drops the reader's reference to the memory map. The file is unmapped once no returned frame uses it.
+        """
+        self.frames = np.zeros(0, dtype=self.dtype)
+        self.n_frames = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()